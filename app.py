@@ -1,12 +1,18 @@
 import base64
+import bisect
 import csv
 import hashlib
 import hmac
+import json
 import os
 import uuid
 import random
+import re
 import smtplib
 import string
+import threading
+import time
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
 from datetime import timedelta
 from email.mime.multipart import MIMEMultipart
@@ -22,28 +28,48 @@ from flask import send_from_directory
 
 import dotenv
 import requests
-import sqlalchemy.orm.attributes
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, jsonify
+from requests.adapters import HTTPAdapter
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, jsonify, g, \
+    Response, stream_with_context, abort, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql as mysql_dialect, sqlite as sqlite_dialect
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import NotFound
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only the original upload is kept
+    Image = ImageOps = None
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess as prometheus_multiprocess
+except ImportError:  # prometheus_client is optional; without it /metrics is unavailable
+    prometheus_client = prometheus_multiprocess = None
+
 dotenv.load_dotenv()
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+# DATABASE_URL overrides the MySQL settings, e.g. sqlite:///bench.db for benchmark.py
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL') or \
+    f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'images', 'products')
+app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'uploads', 'products')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 db = SQLAlchemy(app)
 
+LOW_STOCK_THRESHOLD = 10
+
 VALID_SIZES = {
     'XS', 'S', 'M', 'L', 'XL', '2XL',
     '28', '30', '32', '34', '36', '38', '40',
@@ -92,17 +118,43 @@ class Product(db.Model):
     name = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.Text)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
-    size_quantities = db.Column(db.JSON, nullable=False, default=dict)
     color = db.Column(db.String(30), nullable=False)
     price = db.Column(db.Float, nullable=False)
     image_filename = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    is_deleted = db.Column(db.Boolean, default=False, index=True)
+    is_deleted = db.Column(db.Boolean, default=False)
+    stock_levels = db.relationship('ProductSize', backref='product', lazy='selectin',
+                                   cascade='all, delete-orphan')
+
+    # Match the browse queries (filter, then sort) so pages are read in index order without a filesort
+    __table_args__ = (
+        db.Index('ix_products_browse', 'is_deleted', 'name'),
+        db.Index('ix_products_category_browse', 'is_deleted', 'category_id', 'name'),
+        db.Index('ix_products_recent', 'is_deleted', 'created_at'),
+    )
+
+    @property
+    def size_quantities(self):
+        """Read-only {size: quantity} view of the product_size rows."""
+        return {level.size: level.quantity for level in self.stock_levels}
+
+    @size_quantities.setter
+    def size_quantities(self, value):
+        value = value or {}
+        for level in list(self.stock_levels):
+            if level.size not in value:
+                self.stock_levels.remove(level)
+        existing = {level.size: level for level in self.stock_levels}
+        for size, quantity in value.items():
+            if size in existing:
+                existing[size].quantity = quantity
+            else:
+                self.stock_levels.append(ProductSize(size=size, quantity=quantity))
 
     @property
     def total_quantity(self):
-        return sum(self.size_quantities.values()) if self.size_quantities else 0
+        return sum(level.quantity for level in self.stock_levels)
 
 
 class Size(db.Model):
@@ -112,20 +164,113 @@ class Size(db.Model):
     size_value = db.Column(db.String(20), nullable=False)
     size_type = db.Column(db.String(20), nullable=False)  # 'shirt' or 'pant'
 
-
-    product_sizes = db.relationship('ProductSize', backref='size', lazy=True)
-
-
     __table_args__ = (db.UniqueConstraint('size_value', 'size_type', name='unique_size_type'),)
 
 
 class ProductSize(db.Model):
+    """Stock on hand for one (product, size); the source of truth for inventory."""
     __tablename__ = 'product_size'
 
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
-    size_id = db.Column(db.Integer, db.ForeignKey('size.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    size = db.Column(db.String(20), primary_key=True)
     quantity = db.Column(db.Integer, nullable=False, default=0)
 
+    __table_args__ = (db.CheckConstraint('quantity >= 0', name='ck_product_size_quantity'),)
+
+
+def lock_stock(keys):
+    """SELECT ... FOR UPDATE the stock rows for (product_id, size) keys, in primary-key order.
+
+    Every checkout locks in the same order, so two carts that share products
+    queue behind each other instead of deadlocking.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+    rows = db.session.execute(
+        db.select(ProductSize.product_id, ProductSize.size, ProductSize.quantity)
+        .where(db.tuple_(ProductSize.product_id, ProductSize.size).in_(keys))
+        .order_by(ProductSize.product_id, ProductSize.size)
+        .with_for_update()
+    ).all()
+    return {(product_id, size): quantity for product_id, size, quantity in rows}
+
+
+def take_stock(quantities):
+    """Decrement {(product_id, size): quantity} stock rows with a single UPDATE.
+
+    Rows without enough stock are left alone and the call returns False; the
+    caller must then roll back. After lock_stock() and an availability check
+    this always returns True.
+    """
+    if not quantities:
+        return True
+    amount = db.case(*[((ProductSize.product_id == product_id) & (ProductSize.size == size), quantity)
+                       for (product_id, size), quantity in quantities.items()])
+    result = db.session.execute(
+        db.update(ProductSize)
+        .where(db.tuple_(ProductSize.product_id, ProductSize.size).in_(list(quantities)),
+               ProductSize.quantity >= amount)
+        .values(quantity=ProductSize.quantity - amount)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(quantities)
+
+
+def return_stock(product_id, size, quantity):
+    result = db.session.execute(
+        db.update(ProductSize)
+        .where(ProductSize.product_id == product_id, ProductSize.size == size)
+        .values(quantity=ProductSize.quantity + quantity)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.add(ProductSize(product_id=product_id, size=size, quantity=quantity))
+
+
+def return_stock_bulk(levels):
+    """return_stock for many (product_id, size, quantity) rows, one executemany per statement.
+
+    Rows are updated in lock_stock()'s (product_id, size) order, so a sweep
+    and a checkout that share products cannot deadlock.
+    """
+    quantities = {}
+    for product_id, size, quantity in levels:
+        quantities[product_id, size] = quantities.get((product_id, size), 0) + int(quantity)
+    levels = [(product_id, size, quantity) for (product_id, size), quantity in sorted(quantities.items())]
+    if not levels:
+        return
+    existing = {tuple(row) for row in db.session.execute(
+        db.select(ProductSize.product_id, ProductSize.size)
+        .where(ProductSize.product_id.in_({product_id for product_id, _, _ in levels})))}
+    stock = ProductSize.__table__
+    updates = [{'b_product_id': product_id, 'b_size': size, 'b_quantity': quantity}
+               for product_id, size, quantity in levels if (product_id, size) in existing]
+    if updates:
+        db.session.execute(
+            stock.update()
+            .where(stock.c.product_id == db.bindparam('b_product_id'), stock.c.size == db.bindparam('b_size'))
+            .values(quantity=stock.c.quantity + db.bindparam('b_quantity')),
+            updates)
+    missing = [{'product_id': product_id, 'size': size, 'quantity': quantity}
+               for product_id, size, quantity in levels if (product_id, size) not in existing]
+    if missing:
+        db.session.execute(stock.insert(), missing)
+
+
+def restock_order(order):
+    for detail in order.order_details:
+        return_stock(detail.product_id, detail.size, detail.quantity)
+
+
+def retake_order_stock(order):
+    """Take a released order's stock again; False (caller rolls back) if any size ran short."""
+    quantities = {}
+    for detail in order.order_details:
+        key = (detail.product_id, detail.size)
+        quantities[key] = quantities.get(key, 0) + detail.quantity
+    return take_stock(quantities)
+
 
 class Customer(db.Model):
     __tablename__ = 'customers'
@@ -151,8 +296,21 @@ class Order(db.Model):
     payment_method = db.Column(db.String(50))
     payment_status = db.Column(db.String(20), nullable=False, default='Unpaid', index=True)
     payment_reference = db.Column(db.String(255), index=True)
-    is_deleted = db.Column(db.Boolean, default=False, index=True)
+    # Unpaid orders hold their stock until this time, then reservation_sweeper.py releases it
+    reserved_until = db.Column(db.DateTime, index=True)
+    # Sent with the checkout form so a resubmitted form finds this order instead of creating another
+    idempotency_key = db.Column(db.String(64), unique=True)
+    is_deleted = db.Column(db.Boolean, default=False)
     order_details = db.relationship('OrderDetail', backref='order', lazy=True, cascade='all, delete-orphan')
+    # Line-item count, populated by queries that use with_expression()
+    item_count = db.query_expression()
+
+    # my_orders() and admin_orders() filter on these columns and page newest first
+    __table_args__ = (
+        db.Index('ix_orders_customer_history', 'customer_id', 'is_deleted', 'order_date'),
+        db.Index('ix_orders_deleted_date', 'is_deleted', 'order_date'),
+        db.Index('ix_orders_deleted_status_date', 'is_deleted', 'status', 'order_date'),
+    )
 
 
 class OrderDetail(db.Model):
@@ -166,12 +324,133 @@ class OrderDetail(db.Model):
     product = db.relationship('Product', backref='order_details', lazy=True)
 
 
+class Cart(db.Model):
+    __tablename__ = 'carts'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    items = db.Column(db.JSON, nullable=False, default=dict)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class OutboxEmail(db.Model):
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html_body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),)
+
+
+class PaymentEvent(db.Model):
+    """Verified gateway webhook waiting for (or already through) payment_worker.py."""
+    __tablename__ = 'payment_events'
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(64), nullable=False, unique=True)
+    event_type = db.Column(db.String(64), nullable=False)
+    payment_reference = db.Column(db.String(255), index=True)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(500))
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_payment_events_status_id', 'status', 'id'),)
+
+
+class SchemaVersion(db.Model):
+    """A migration from migrations.py that has been applied to this database."""
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    duration_ms = db.Column(db.Float, nullable=False, default=0)
+    # [{statement, algorithm, duration_ms}] for each statement the migration ran
+    steps = db.Column(db.JSON)
+
+
+# ---------------------------------------------------------------------------
+# Authentication
+# ---------------------------------------------------------------------------
+
+PRINCIPAL_CACHE_SECONDS = int(os.getenv('PRINCIPAL_CACHE_SECONDS', 30))
+PRINCIPAL_CACHE_MAX_KEYS = 4096
+
+_principal_cache = OrderedDict()
+_principal_cache_lock = threading.Lock()
+
+
+class Principal:
+    """The few user fields request handlers need, without an ORM instance."""
+    __slots__ = ('id', 'username', 'role', 'is_active')
+
+    def __init__(self, id, username, role, is_active):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.is_active = is_active
+
+    @property
+    def is_admin(self):
+        return self.role == 'Admin'
+
+
+def load_principal(user_id):
+    """Look a user up, sharing the result across requests for PRINCIPAL_CACHE_SECONDS.
+
+    Role and activation changes made in this process invalidate the entry at
+    once; other workers pick them up when their entry expires.
+    """
+    now = time.monotonic()
+    with _principal_cache_lock:
+        entry = _principal_cache.get(user_id)
+        if entry and entry[1] > now:
+            _principal_cache.move_to_end(user_id)
+            return entry[0]
+    row = db.session.query(User.id, User.username, User.role, User.is_active).filter(User.id == user_id).first()
+    principal = Principal(row.id, row.username, row.role, bool(row.is_active)) if row else None
+    with _principal_cache_lock:
+        _principal_cache[user_id] = (principal, now + PRINCIPAL_CACHE_SECONDS)
+        _principal_cache.move_to_end(user_id)
+        while len(_principal_cache) > PRINCIPAL_CACHE_MAX_KEYS:
+            _principal_cache.popitem(last=False)
+    return principal
+
+
+def invalidate_principal(user_id):
+    with _principal_cache_lock:
+        _principal_cache.pop(user_id, None)
+    if g.get('_principal') is not None and g._principal.id == user_id:
+        g.pop('_principal')
+
+
+def get_current_user():
+    """The signed-in user's Principal, loaded at most once per request."""
+    if 'user_id' not in session:
+        return None
+    if '_principal' not in g:
+        g._principal = load_principal(session['user_id'])
+    return g._principal
+
+
 def login_required(f: Callable) -> Callable:
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
             return redirect(url_for('login'))
+        user = get_current_user()
+        if not user or not user.is_active:
+            session.clear()
+            flash('Your session is no longer valid. Please log in again.', 'warning')
+            return redirect(url_for('login'))
         return f(*args, **kwargs)
 
     return decorated_function
@@ -180,7 +459,8 @@ def login_required(f: Callable) -> Callable:
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or session.get('role') != 'Admin':
+        user = get_current_user()
+        if not user or not user.is_active or not user.is_admin:
             flash('Admin access required for this action.', 'danger')
             return redirect(url_for('dashboard'))
         return f(*args, **kwargs)
@@ -188,19 +468,200 @@ def admin_required(f):
     return decorated_function
 
 
-def get_current_user():
-    if 'user_id' in session:
-        return db.session.get(User, session['user_id'])
-    return None
+# ---------------------------------------------------------------------------
+# Cart storage
+# ---------------------------------------------------------------------------
+
+app.config['CART_BACKEND'] = os.getenv('CART_BACKEND', 'sql').lower()
+app.config['CART_TTL'] = timedelta(days=int(os.getenv('CART_TTL_DAYS', 30)))
+
+
+def pack_cart(cart):
+    """Compact stored form: {"<product_id>_<size>": [quantity, price]}."""
+    return {key: [item['quantity'], item['price']] for key, item in cart.items()}
+
+
+def unpack_cart(packed):
+    """Inverse of pack_cart; also reads the {key: {product_id, size, ...}} carts of the old session cart.
+
+    Entries that fit neither shape are dropped rather than failing every page
+    that shows the cart count.
+    """
+    cart = {}
+    for key, value in (packed or {}).items():
+        try:
+            if isinstance(value, dict):
+                product_id, size = int(value['product_id']), value['size']
+                quantity, price = value['quantity'], value['price']
+            else:
+                quantity, price = value
+                product_id, _, size = key.partition('_')
+                product_id = int(product_id)
+        except (KeyError, TypeError, ValueError):
+            continue
+        cart[key] = {'product_id': product_id, 'size': size, 'quantity': int(quantity), 'price': float(price)}
+    return cart
+
+
+class SessionCartStore:
+    """Legacy store: the cart rides along in the signed session cookie."""
+
+    def load(self, user_id):
+        return session.get('cart')
+
+    def save(self, user_id, packed):
+        session['cart'] = packed
+        session.modified = True
+
+    def clear(self, user_id):
+        session.pop('cart', None)
+
+
+class MemoryCartStore:
+    """Per-process store with TTL eviction; only suitable for a single worker."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl.total_seconds()
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        entry = self._carts.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self.clear(user_id)
+            return None
+        return entry[0]
+
+    def save(self, user_id, packed):
+        now = time.monotonic()
+        with self._lock:
+            self._carts[user_id] = (packed, now + self.ttl)
+            if len(self._carts) % 1000 == 0:
+                for key in [k for k, (_, expires) in self._carts.items() if expires < now]:
+                    del self._carts[key]
+
+    def clear(self, user_id):
+        with self._lock:
+            self._carts.pop(user_id, None)
+
+
+class SqlCartStore:
+    """Carts table keyed by user id.
+
+    Runs its own short transaction on the engine so saving a cart never
+    commits or expires whatever the request has pending in db.session.
+    """
+
+    purge_interval = 3600
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._purged_at = 0.0
+
+    def load(self, user_id):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.select(Cart.items).where(Cart.user_id == user_id,
+                                            Cart.updated_at >= datetime.utcnow() - self.ttl)
+            ).scalar()
+
+    def save(self, user_id, packed):
+        values = {'user_id': user_id, 'items': packed, 'updated_at': datetime.utcnow()}
+        with db.engine.begin() as conn:
+            # A single upsert, so two concurrent saves for one user cannot both try to insert
+            if conn.dialect.name == 'mysql':
+                insert = mysql_dialect.insert(Cart).values(values)
+                conn.execute(insert.on_duplicate_key_update(items=insert.inserted['items'],
+                                                            updated_at=insert.inserted.updated_at))
+            elif conn.dialect.name == 'sqlite':
+                insert = sqlite_dialect.insert(Cart).values(values)
+                conn.execute(insert.on_conflict_do_update(
+                    index_elements=[Cart.user_id],
+                    set_={'items': insert.excluded['items'], 'updated_at': insert.excluded.updated_at}))
+            else:
+                updated = conn.execute(db.update(Cart).where(Cart.user_id == user_id)
+                                       .values(items=packed, updated_at=values['updated_at']))
+                if not updated.rowcount:
+                    conn.execute(db.insert(Cart).values(values))
+        self._maybe_purge()
+
+    def clear(self, user_id):
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(Cart).where(Cart.user_id == user_id))
+
+    def purge_expired(self):
+        with db.engine.begin() as conn:
+            return conn.execute(db.delete(Cart).where(Cart.updated_at < datetime.utcnow() - self.ttl)).rowcount
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = now
+        try:
+            self.purge_expired()
+        except Exception as e:
+            app.logger.error(f"Cart purge error: {e}")
+
+
+CART_BACKENDS = {
+    'session': lambda: SessionCartStore(),
+    'memory': lambda: MemoryCartStore(app.config['CART_TTL']),
+    'sql': lambda: SqlCartStore(app.config['CART_TTL']),
+}
+
+cart_store = CART_BACKENDS[app.config['CART_BACKEND']]()
 
 
 def get_cart():
-    return session.get('cart', {})
+    if 'user_id' not in session:
+        return {}
+    if '_cart' not in g:
+        packed = cart_store.load(session['user_id'])
+        if packed is None and not isinstance(cart_store, SessionCartStore) and session.get('cart'):
+            # Carry over a cart left in the cookie by the old session-based cart
+            packed = pack_cart(unpack_cart(session.pop('cart')))
+            cart_store.save(session['user_id'], packed)
+        g._cart = unpack_cart(packed)
+    return g._cart
 
 
 def save_cart(cart):
-    session['cart'] = cart
-    session.modified = True
+    if 'user_id' not in session:
+        return
+    cart_store.save(session['user_id'], pack_cart(cart))
+    g._cart = cart
+
+
+def clear_cart():
+    if 'user_id' in session:
+        cart_store.clear(session['user_id'])
+    g.pop('_cart', None)
+
+
+def load_cart_products(cart):
+    """Fetch every product referenced by the cart in a single IN (...) query."""
+    product_ids = {item.get('product_id') for item in cart.values() if item.get('product_id')}
+    if not product_ids:
+        return {}
+    return {product.id: product for product in Product.query.filter(Product.id.in_(product_ids)).all()}
+
+
+def build_cart_items(cart, products):
+    cart_items = []
+    for item_data in cart.values():
+        product = products.get(item_data.get('product_id'))
+        size = item_data.get('size')
+        if product and not product.is_deleted and size:
+            cart_items.append({
+                'product': product,
+                'quantity': item_data['quantity'],
+                'size': size,
+                'subtotal': item_data['price'] * item_data['quantity']
+            })
+    return cart_items
 
 
 def calculate_cart_total(cart):
@@ -301,26 +762,561 @@ def validate_product(product_code, name, category_id, color, price, size_quantit
 
 
 
-def save_product_image(image_file, product_code):
+# ---------------------------------------------------------------------------
+# Product images
+# ---------------------------------------------------------------------------
+
+IMAGE_RENDITIONS = {
+    'thumb': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Stored names start with a content hash, so the bytes behind a URL never change
+HASHED_IMAGE_RE = re.compile(r'^(?:renditions/)?([0-9a-f]{24})(?:_(?:thumb|card|detail))?\.[a-z0-9]+$')
+IMAGE_CACHE_SECONDS = 365 * 24 * 3600
+IMAGE_LOOKUP_SECONDS = 300
+
+_image_lookup = {}
+_image_lookup_lock = threading.Lock()
+
+
+def rendition_filename(image_filename, size, fmt):
+    """Path of a rendition relative to UPLOAD_FOLDER."""
+    return f"renditions/{os.path.splitext(image_filename)[0]}_{size}.{fmt}"
+
+
+def generate_renditions(source_path, image_filename):
+    """Write every size/format rendition; thumb and card are square crops."""
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], 'renditions')
+    os.makedirs(folder, exist_ok=True)
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            flattened = Image.new('RGB', image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel('A'))
+            image = flattened
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        for size, box in IMAGE_RENDITIONS.items():
+            if size == 'detail':
+                rendition = image.copy()
+                rendition.thumbnail(box, Image.LANCZOS)
+            else:
+                rendition = ImageOps.fit(image, box, Image.LANCZOS)
+            for fmt, (pil_format, options) in IMAGE_FORMATS.items():
+                rendition.save(os.path.join(app.config['UPLOAD_FOLDER'], rendition_filename(image_filename, size, fmt)),
+                               pil_format, **options)
+
+
+def store_product_image(data, ext):
+    """Store image bytes under a content-hashed name and pre-render its renditions.
+
+    Returns the stored filename, or None if the data is not a usable image.
+    """
+    if not data:
+        return None
+    image_filename = f"{hashlib.sha256(data).hexdigest()[:24]}.{ext.lower()}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
+    # The same bytes may already be stored for another product; only a file this
+    # call wrote may be removed again on failure
+    created = False
+    try:
+        if not os.path.exists(filepath):
+            temp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, filepath)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            created = True
+        if Image is not None:
+            generate_renditions(filepath, image_filename)
+            image_manifest.add(*[rendition_filename(image_filename, size, fmt)
+                                 for size in IMAGE_RENDITIONS for fmt in IMAGE_FORMATS])
+        image_manifest.add(image_filename)
+        return image_filename
+    except Exception as e:
+        app.logger.error(f"Image save error: {e}")
+        if created:
+            os.remove(filepath)
+            image_manifest.discard(image_filename)
+        return None
+
+
+def save_product_image(image_file):
     if not image_file or not image_file.filename:
         return None
+    ext = image_file.filename.rsplit('.', 1)[1] if '.' in image_file.filename else 'jpg'
+    return store_product_image(image_file.read(), ext)
 
-    ext = image_file.filename.rsplit('.', 1)[1].lower() if '.' in image_file.filename else 'jpg'
-    filename = f"{product_code.replace(' ', '_')}_{int(time.time())}.{ext}"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-    try:
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        image_file.save(filepath)
-        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-            return filename
-        os.remove(filepath)
+class ImageManifest:
+    """In-memory listing of UPLOAD_FOLDER so building image URLs never touches the disk.
+
+    Stores and deletes in this process update it directly. Files written or
+    removed by other workers or by backfill_product_images.py are picked up by
+    a daemon thread that rescans the folder every refresh_interval seconds;
+    lookups only ever read the current set.
+    """
+
+    refresh_interval = 60
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._files = frozenset()
+        # filename -> (monotonic time, present) for add/discard calls, so a rescan
+        # that was already running does not undo them
+        self._changes = {}
+        self._refresher_pid = None
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        started = time.monotonic()
+        files = set()
+        for subfolder in ('', 'renditions'):
+            try:
+                with os.scandir(os.path.join(self.folder, subfolder)) as entries:
+                    files.update(f"{subfolder}/{entry.name}" if subfolder else entry.name
+                                 for entry in entries if entry.is_file())
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._changes = {name: change for name, change in self._changes.items() if change[0] >= started}
+            files.update(name for name, (_, present) in self._changes.items() if present)
+            files.difference_update(name for name, (_, present) in self._changes.items() if not present)
+            self._files = frozenset(files)
+
+    def add(self, *filenames):
+        self._record(filenames, True)
+
+    def discard(self, *filenames):
+        self._record(filenames, False)
+
+    def _record(self, filenames, present):
+        now = time.monotonic()
+        with self._lock:
+            self._changes.update((name, (now, present)) for name in filenames)
+            self._files = self._files.union(filenames) if present else self._files.difference(filenames)
+
+    def start_refresher(self):
+        """Start the rescan thread; once per process, so forked workers get their own."""
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_forever, name='image-manifest', daemon=True).start()
+
+    def _refresh_forever(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.rebuild()
+            except OSError as e:
+                app.logger.warning(f"Image manifest rescan failed: {e}")
+
+    def __contains__(self, filename):
+        if self._refresher_pid != os.getpid():
+            self.start_refresher()
+        return filename in self._files
+
+
+image_manifest = ImageManifest(app.config['UPLOAD_FOLDER'])
+image_manifest.rebuild()
+
+
+def uploaded_image_url(filename):
+    if HASHED_IMAGE_RE.match(filename):
+        return url_for('product_image_file', filename=filename)
+    return url_for('static', filename=f'uploads/products/{filename}')
+
+
+def product_image_url(product, size=None, fmt='jpg'):
+    """URL for a rendition (or the original when size is None), with fallback."""
+    if product.image_filename:
+        if size:
+            rendition = rendition_filename(product.image_filename, size, fmt)
+            if rendition in image_manifest:
+                return uploaded_image_url(rendition)
+        if product.image_filename in image_manifest:
+            return uploaded_image_url(product.image_filename)
+    return url_for('static', filename='images/placeholder.png')
+
+
+def lookup_product_image(product_id):
+    """image_filename for a product ('' if it has none), cached for a few minutes.
+
+    Returns None if the product does not exist.
+    """
+    now = time.monotonic()
+    entry = _image_lookup.get(product_id)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+    image_filename = db.session.execute(
+        db.select(Product.image_filename).where(Product.id == product_id, Product.is_deleted == False)
+    ).first()
+    if image_filename is None:
         return None
+    with _image_lookup_lock:
+        _image_lookup[product_id] = (image_filename[0] or '', now + IMAGE_LOOKUP_SECONDS)
+    return image_filename[0] or ''
+
+
+def forget_product_image(product_id):
+    with _image_lookup_lock:
+        _image_lookup.pop(product_id, None)
+
+
+# ---------------------------------------------------------------------------
+# Product search
+# ---------------------------------------------------------------------------
+
+SEARCH_FIELD_WEIGHTS = {'product_code': 3, 'name': 2, 'color': 1}
+SEARCH_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize_search_text(text):
+    return SEARCH_TOKEN_RE.findall((text or '').lower())
+
+
+class MemorySearchBackend:
+    """In-process inverted index over product code, name and color.
+
+    Each worker keeps its own copy; it is built lazily on the first search and
+    refreshed from products.updated_at so edits made by other workers show up
+    within SEARCH_INDEX_REFRESH_SECONDS.
+    """
+
+    def __init__(self, refresh_seconds=60, max_results=500):
+        self.refresh_seconds = refresh_seconds
+        self.max_results = max_results
+        self._postings = {}
+        self._doc_tokens = {}
+        self._doc_categories = {}
+        self._sorted_tokens = []
+        self._synced_at = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _add(self, product_id, product_code, name, color, category_id):
+        self._remove(product_id)
+        self._doc_categories[product_id] = category_id
+        tokens = {}
+        for field, value in (('product_code', product_code), ('name', name), ('color', color)):
+            for token in tokenize_search_text(value):
+                tokens[token] = max(tokens.get(token, 0), SEARCH_FIELD_WEIGHTS[field])
+        self._doc_tokens[product_id] = tokens
+        for token, weight in tokens.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._sorted_tokens, token)
+            postings[product_id] = weight
+
+    def _remove(self, product_id):
+        self._doc_categories.pop(product_id, None)
+        for token in self._doc_tokens.pop(product_id, {}):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                pos = bisect.bisect_left(self._sorted_tokens, token)
+                if pos < len(self._sorted_tokens) and self._sorted_tokens[pos] == token:
+                    del self._sorted_tokens[pos]
+
+    def _load(self, since=None):
+        columns = db.session.query(Product.id, Product.product_code, Product.name, Product.color,
+                                   Product.category_id, Product.is_deleted, Product.updated_at)
+        if since is not None:
+            columns = columns.filter(Product.updated_at >= since)
+        latest = self._synced_at
+        for row in columns.yield_per(1000):
+            if row.is_deleted:
+                self._remove(row.id)
+            else:
+                self._add(row.id, row.product_code, row.name, row.color, row.category_id)
+            if row.updated_at and (latest is None or row.updated_at > latest):
+                latest = row.updated_at
+        self._synced_at = latest or datetime.utcnow()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._synced_at is not None and now - self._checked_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if self._synced_at is None:
+                self._load()
+            elif now - self._checked_at >= self.refresh_seconds:
+                self._load(since=self._synced_at)
+            self._checked_at = now
+
+    def index_product(self, product):
+        with self._lock:
+            if product.is_deleted:
+                self._remove(product.id)
+            else:
+                self._add(product.id, product.product_code, product.name, product.color, product.category_id)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def rebuild(self):
+        with self._lock:
+            self._postings, self._doc_tokens, self._doc_categories, self._sorted_tokens = {}, {}, {}, []
+            self._synced_at = None
+            self._load()
+            self._checked_at = time.monotonic()
+
+    def _matches(self, term):
+        """Exact hits score full field weight, prefix hits score half."""
+        scores = dict(self._postings.get(term, {}))
+        pos = bisect.bisect_left(self._sorted_tokens, term)
+        while pos < len(self._sorted_tokens) and self._sorted_tokens[pos].startswith(term):
+            token = self._sorted_tokens[pos]
+            if token != term:
+                for product_id, weight in self._postings[token].items():
+                    scores[product_id] = max(scores.get(product_id, 0), weight / 2)
+            pos += 1
+        return scores
+
+    def ranked_ids(self, search, category_id=None):
+        """Best matches first, at most max_results of them.
+
+        Deleted products are not in the index, and the category filter is
+        applied here, before the cap, so a narrow category is not starved by
+        better-scoring hits elsewhere.
+        """
+        terms = tokenize_search_text(search)
+        if not terms:
+            return []
+        self._ensure_fresh()
+        with self._lock:
+            totals = None
+            for term in terms:
+                scores = self._matches(term)
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {pid: totals[pid] + s for pid, s in scores.items() if pid in totals}
+                if not totals:
+                    return []
+            if category_id is not None:
+                totals = {pid: score for pid, score in totals.items() if self._doc_categories.get(pid) == category_id}
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[:self.max_results]]
+
+    def apply(self, query, search, category_id=None):
+        ids = self.ranked_ids(search, category_id)
+        if not ids:
+            return query.filter(db.false())
+        rank = db.case({product_id: pos for pos, product_id in enumerate(ids)}, value=Product.id)
+        return query.filter(Product.id.in_(ids)).order_by(rank)
+
+
+class FullTextSearchBackend:
+    """MySQL FULLTEXT search; needs the ft_products_search index on products.
+
+    MATCH only fails when the query runs, after search_products() has handed
+    it to the route, so the index is probed once up front (and again every
+    PROBE_RETRY_SECONDS while it is missing) and apply() raises instead.
+    """
+    PROBE_RETRY_SECONDS = 300
+
+    def __init__(self):
+        self._available = None
+        self._probed_at = 0.0
+        self._lock = threading.Lock()
+
+    def available(self):
+        now = time.monotonic()
+        if self._available or (self._available is False and now - self._probed_at < self.PROBE_RETRY_SECONDS):
+            return self._available
+        with self._lock:
+            if self._available is None or (not self._available and now - self._probed_at >= self.PROBE_RETRY_SECONDS):
+                try:
+                    with db.engine.connect() as connection:
+                        connection.execute(db.text(
+                            'SELECT 1 FROM products WHERE MATCH (product_code, name, color) '
+                            "AGAINST ('probe' IN BOOLEAN MODE) LIMIT 1"))
+                    self._available = True
+                except Exception as e:
+                    app.logger.error(f"FULLTEXT index ft_products_search unavailable: {e}")
+                    self._available = False
+                self._probed_at = now
+        return self._available
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def apply(self, query, search, category_id=None):
+        # The caller's SQL filters do the rest; MATCH has no result cap
+        if not self.available():
+            raise RuntimeError("FULLTEXT search index is not available")
+        terms = tokenize_search_text(search)
+        if not terms:
+            return query.filter(db.false())
+        boolean_query = ' '.join(f'+{term}*' for term in terms)
+        match = db.text('MATCH (products.product_code, products.name, products.color) '
+                        'AGAINST (:search_terms IN BOOLEAN MODE)').bindparams(search_terms=boolean_query)
+        return query.filter(match).order_by(db.desc(match))
+
+
+SEARCH_BACKENDS = {
+    'memory': lambda: MemorySearchBackend(
+        refresh_seconds=int(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', 60)),
+        max_results=int(os.getenv('SEARCH_MAX_RESULTS', 500))),
+    'fulltext': FullTextSearchBackend,
+}
+
+search_backend = SEARCH_BACKENDS[os.getenv('SEARCH_BACKEND', 'memory').lower()]()
+
+
+def search_products(query, search, category_id=None):
+    """Restrict a Product query to search hits, best matches first.
+
+    Pass the category the query is filtered on so a capped backend can apply
+    it before the cap.
+    """
+    try:
+        return search_backend.apply(query, search, category_id)
     except Exception as e:
-        app.logger.error(f"Image save error: {e}")
+        app.logger.error(f"Search backend error, falling back to LIKE: {e}")
+        return query.filter((Product.product_code.ilike(f'%{search}%')) | (Product.name.ilike(f'%{search}%')) |
+                            (Product.color.ilike(f'%{search}%')))
+
+
+# ---------------------------------------------------------------------------
+# Keyset pagination
+# ---------------------------------------------------------------------------
+
+app.config['PAGINATION_MODE'] = os.getenv('PAGINATION_MODE', 'offset').lower()
+app.config['COUNT_CACHE_SECONDS'] = int(os.getenv('COUNT_CACHE_SECONDS', 60))
+
+# Least recently used keys are dropped first; keys include user-supplied filters
+COUNT_CACHE_MAX_KEYS = 1024
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+
+class KeysetPagination:
+    def __init__(self, items, per_page, next_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        self.total = total
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return max(1, -(-self.total // self.per_page))
+
+
+def use_keyset_pagination():
+    return bool(request.args.get('after')) or app.config['PAGINATION_MODE'] == 'keyset'
+
+
+def encode_cursor(values):
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values],
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """Decode an "after" token; returns None for anything malformed."""
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(payload)
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        decoded = []
+        for column, value in zip(columns, values):
+            # JSON lets a crafted token put a list or an object where the driver expects a scalar
+            if isinstance(column.type, db.DateTime):
+                if not isinstance(value, str):
+                    return None
+                value = datetime.fromisoformat(value)
+            elif isinstance(column.type, db.Integer):
+                if not isinstance(value, int) or isinstance(value, bool):
+                    return None
+            elif isinstance(column.type, db.String):
+                if not isinstance(value, str):
+                    return None
+            elif not isinstance(value, (str, int, float)):
+                return None
+            decoded.append(value)
+        return decoded
+    except (ValueError, TypeError):
         return None
 
 
+def count_rows(query):
+    """SELECT COUNT(*) ... WHERE ... without Query.count()'s subquery of every column.
+
+    The count then reads only the columns of the WHERE clause, which the
+    composite indexes cover.
+    """
+    return query.order_by(None).with_entities(db.func.count()).scalar()
+
+
+def cached_count(query, key):
+    """COUNT(*) shared across requests for COUNT_CACHE_SECONDS."""
+    now = time.monotonic()
+    with _count_cache_lock:
+        entry = _count_cache.get(key)
+        if entry and entry[1] > now:
+            _count_cache.move_to_end(key)
+            return entry[0]
+    total = count_rows(query)
+    with _count_cache_lock:
+        _count_cache[key] = (total, now + app.config['COUNT_CACHE_SECONDS'])
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > COUNT_CACHE_MAX_KEYS:
+            _count_cache.popitem(last=False)
+    return total
+
+
+def keyset_paginate(query, columns, after=None, per_page=12, descending=False, count_key=None, count_query=None):
+    """Seek past the row identified by `after` instead of using OFFSET.
+
+    `columns` must end with a unique column (normally the primary key) so the
+    ordering is total. `count_query` counts the total when `query` carries
+    joins that do not change the number of rows.
+    """
+    total = cached_count(count_query or query, count_key) if count_key else None
+    values = decode_cursor(after, columns) if after else None
+    if values:
+        clauses = []
+        for i, column in enumerate(columns):
+            beyond = column < values[i] if descending else column > values[i]
+            clauses.append(db.and_(*[columns[j] == values[j] for j in range(i)], beyond))
+        query = query.filter(db.or_(*clauses))
+    ordering = [column.desc() if descending else column.asc() for column in columns]
+    items = query.order_by(*ordering).limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in columns])
+    return KeysetPagination(items, per_page, next_cursor=next_cursor, total=total)
+
+
 @app.context_processor
 def inject_cart_count():
     cart = get_cart()
@@ -345,44 +1341,914 @@ def inject_category_icon():
 
 @app.context_processor
 def utility_processor():
-    def get_product_image_url(product):
+    def get_product_image_url(product, size=None, fmt='jpg'):
         """Get the URL for a product image, with fallback"""
-        if product.image_filename:
-            image_path = os.path.join(app.static_folder, 'uploads', 'products', product.image_filename)
-            if os.path.exists(image_path):
-                return url_for('static', filename=f'uploads/products/{product.image_filename}')
-        return url_for('static', filename='images/placeholder.jpg')
+        return product_image_url(product, size, fmt)
 
     return dict(get_product_image_url=get_product_image_url)
 
 
+def build_email_message(to_email, subject, html_body):
+    mail_sender = os.getenv('MAIL_DEFAULT_SENDER', os.getenv('MAIL_USERNAME'))
+    message = MIMEMultipart('alternative')
+    message['Subject'] = subject
+    message['From'] = mail_sender
+    message['To'] = to_email
+    message.attach(MIMEText(html_body, 'html'))
+    return message
+
+
+class SMTPSender:
+    """Keeps one SMTP connection open and reuses it across messages."""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True, use_ssl=False, timeout=10,
+                 max_idle=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._server = None
+        self._used_at = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('MAIL_SERVER', 'smtp.gmail.com'), int(os.getenv('MAIL_PORT', 587)),
+                   username=os.getenv('MAIL_USERNAME'), password=os.getenv('MAIL_PASSWORD'),
+                   use_tls=os.getenv('MAIL_USE_TLS', 'True').lower() == 'true',
+                   use_ssl=os.getenv('MAIL_USE_SSL', 'False').lower() == 'true')
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def _connection(self):
+        if self._server is not None and time.monotonic() - self._used_at > self.max_idle:
+            try:
+                self._server.noop()
+            except smtplib.SMTPException:
+                self.close()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def send(self, message):
+        try:
+            self._connection().send_message(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The server dropped an idle connection; reconnect once
+            self.close()
+            self._connection().send_message(message)
+        self._used_at = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def send_email(to_email, subject, html_body):
+    """Send immediately; request handlers should use queue_email instead."""
     try:
-        mail_server = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
-        mail_port = int(os.getenv('MAIL_PORT', 587))
-        mail_username = os.getenv('MAIL_USERNAME')
-        mail_password = os.getenv('MAIL_PASSWORD')
-        mail_sender = os.getenv('MAIL_DEFAULT_SENDER', mail_username)
-
-        if not mail_username or not mail_password:
+        if not os.getenv('MAIL_USERNAME') or not os.getenv('MAIL_PASSWORD'):
             raise Exception("Email configuration missing. Set MAIL_USERNAME and MAIL_PASSWORD in .env")
 
-        message = MIMEMultipart('alternative')
-        message['Subject'] = subject
-        message['From'] = mail_sender
-        message['To'] = to_email
-        message.attach(MIMEText(html_body, 'html'))
-
-        with smtplib.SMTP(mail_server, mail_port, timeout=10) as server:
-            server.starttls()
-            server.login(mail_username, mail_password)
-            server.send_message(message)
+        with SMTPSender.from_env() as sender:
+            sender.send(build_email_message(to_email, subject, html_body))
+        EMAILS_SENT.labels('sent').inc()
         return True
     except Exception as e:
+        EMAILS_SENT.labels('failed').inc()
         app.logger.error(f"Email error: {e}")
         return False
 
 
+# ---------------------------------------------------------------------------
+# Email outbox
+# ---------------------------------------------------------------------------
+
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_RETRY_BASE_SECONDS = int(os.getenv('EMAIL_RETRY_BASE_SECONDS', 30))
+EMAIL_RETRY_MAX_SECONDS = 3600
+# A 'Sending' row older than this belongs to a worker that died mid-batch
+EMAIL_CLAIM_TIMEOUT_SECONDS = int(os.getenv('EMAIL_CLAIM_TIMEOUT_SECONDS', 600))
+# Sent and Failed rows are deleted after this many days
+EMAIL_RETENTION_DAYS = int(os.getenv('EMAIL_RETENTION_DAYS', 7))
+
+
+def queue_email(to_email, subject, html_body):
+    """Append to the outbox; email_worker.py delivers it in the background."""
+    try:
+        db.session.add(OutboxEmail(to_email=to_email, subject=subject, html_body=html_body))
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Email queue error: {e}")
+        return False
+
+
+def email_retry_delay(attempts):
+    delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay + random.uniform(0, delay / 4))
+
+
+def claim_outbox_batch(batch_size=50):
+    """Mark up to `batch_size` due emails as 'Sending' and commit.
+
+    Rows are picked with SKIP LOCKED so several workers can drain the outbox
+    without claiming the same email; the row locks end with the commit, before
+    anything is sent. Claims left behind by a crashed worker are taken over
+    after EMAIL_CLAIM_TIMEOUT_SECONDS.
+    """
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=EMAIL_CLAIM_TIMEOUT_SECONDS)
+    emails = OutboxEmail.query.filter(
+        db.or_(db.and_(OutboxEmail.status == 'Pending', OutboxEmail.next_attempt_at <= now),
+               db.and_(OutboxEmail.status == 'Sending', OutboxEmail.claimed_at < stale))
+    ).order_by(OutboxEmail.next_attempt_at).limit(batch_size).with_for_update(skip_locked=True).all()
+    for email in emails:
+        email.status = 'Sending'
+        email.claimed_at = now
+        email.attempts += 1
+    db.session.commit()
+    return emails
+
+
+def deliver_outbox_batch(sender, batch_size=50):
+    """Send due outbox emails over `sender`; returns how many were attempted.
+
+    No row lock is held while talking to the SMTP server. Bodies (OTP codes,
+    reset links) are blanked once an email is sent or given up on.
+    """
+    emails = claim_outbox_batch(batch_size)
+    for email in emails:
+        try:
+            sender.send(build_email_message(email.to_email, email.subject, email.html_body))
+            email.status = 'Sent'
+            email.sent_at = datetime.utcnow()
+            email.last_error = None
+            email.html_body = ''
+            EMAILS_SENT.labels('sent').inc()
+        except Exception as e:
+            EMAILS_SENT.labels('failed').inc()
+            sender.close()
+            email.last_error = str(e)[:500]
+            if email.attempts >= EMAIL_MAX_ATTEMPTS:
+                email.status = 'Failed'
+                email.html_body = ''
+                app.logger.error(f"Email {email.id} to {email.to_email} failed permanently: {e}")
+            else:
+                email.status = 'Pending'
+                email.next_attempt_at = datetime.utcnow() + email_retry_delay(email.attempts)
+        email.claimed_at = None
+    db.session.commit()
+    return len(emails)
+
+
+def purge_outbox(retention_days=None):
+    """Delete Sent and Failed emails older than EMAIL_RETENTION_DAYS; returns how many."""
+    days = EMAIL_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = OutboxEmail.query.filter(OutboxEmail.status.in_(('Sent', 'Failed')),
+                                       OutboxEmail.created_at < cutoff) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# ---------------------------------------------------------------------------
+# Stock reservations
+# ---------------------------------------------------------------------------
+
+RESERVATION_MINUTES = int(os.getenv('RESERVATION_MINUTES', 30))
+# Orders in these payment states only hold a reservation. 'Awaiting' is a
+# gateway checkout the customer may still abandon; once a manual method is
+# chosen ('Pending') or the webhook confirms payment ('Paid') the stock stays taken.
+RESERVED_PAYMENT_STATUSES = ('Unpaid', 'Failed', 'Awaiting')
+RELEASED_ORDER_STATUSES = ('Cancelled', 'Expired')
+
+
+def reservation_deadline():
+    return datetime.utcnow() + timedelta(minutes=RESERVATION_MINUTES)
+
+
+def release_expired_reservations(batch_size=500):
+    """Give back the stock of lapsed unpaid orders and mark them Expired; returns how many expired.
+
+    Quantities are summed per (product, size) across the whole batch, so a
+    sweep costs the same few statements however many orders it covers.
+    """
+    now = datetime.utcnow()
+    order_ids = db.session.execute(
+        db.select(Order.id)
+        .where(Order.reserved_until <= now, Order.status == 'Pending',
+               Order.payment_status.in_(RESERVED_PAYMENT_STATUSES))
+        .order_by(Order.reserved_until).limit(batch_size).with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not order_ids:
+        db.session.rollback()
+        return 0
+
+    return_stock_bulk(db.session.execute(
+        db.select(OrderDetail.product_id, OrderDetail.size, db.func.sum(OrderDetail.quantity))
+        .where(OrderDetail.order_id.in_(order_ids))
+        .group_by(OrderDetail.product_id, OrderDetail.size)
+    ).all())
+    db.session.execute(
+        db.update(Order).where(Order.id.in_(order_ids))
+        .values(status='Expired', reserved_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return len(order_ids)
+
+
+# ---------------------------------------------------------------------------
+# Payment gateway
+# ---------------------------------------------------------------------------
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class CircuitOpenError(PaymentGatewayError):
+    pass
+
+
+class CircuitBreaker:
+    """Fails fast after `failure_threshold` consecutive failures.
+
+    After `reset_timeout` seconds one trial call is let through; its result
+    closes the circuit again or re-opens it for another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a trial call that recorded neither outcome, so the next one can run."""
+        with self._lock:
+            self._trial_running = False
+
+
+class PayMongoClient:
+    """PayMongo REST client sharing one pooled requests.Session per process.
+
+    Timeouts and 429/5xx responses are retried with jittered exponential
+    backoff. POSTs are only retried when they carry an Idempotency-Key. Once
+    the gateway keeps failing, the circuit breaker rejects calls immediately
+    so checkout does not pile up waiting on it.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, secret_key, base_url='https://api.paymongo.com/v1', timeout=(3.05, 10), max_retries=2,
+                 backoff=0.25, backoff_max=2.0, pool_size=20, breaker=None):
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.session.auth = (secret_key or '', '')
+        self.session.headers.update({'Accept': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv('PAYMONGO_SECRET_KEY', ''),
+                   base_url=os.getenv('PAYMONGO_API_BASE', 'https://api.paymongo.com/v1'),
+                   timeout=(3.05, float(os.getenv('PAYMENT_TIMEOUT', 10))),
+                   max_retries=int(os.getenv('PAYMENT_MAX_RETRIES', 2)))
+
+    @property
+    def configured(self):
+        return bool(self.secret_key)
+
+    def _request(self, method, path, payload=None, idempotency_key=None):
+        if not self.breaker.allow():
+            raise CircuitOpenError('Payment gateway is unavailable, please try again shortly')
+        try:
+            return self._send(method, path, payload, idempotency_key)
+        finally:
+            self.breaker.release_trial()
+
+    def _send(self, method, path, payload, idempotency_key):
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        retryable = method == 'GET' or idempotency_key is not None
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", json=payload, headers=headers,
+                                                timeout=self.timeout)
+                if response.status_code not in self.RETRY_STATUSES:
+                    break
+                error = PaymentGatewayError(f"Payment gateway returned HTTP {response.status_code}")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = PaymentGatewayError(f"Payment gateway unreachable: {e}")
+            except requests.RequestException as e:
+                # Broken chunked/encoded bodies, redirect loops: retrying will not help
+                self.breaker.record_failure()
+                raise PaymentGatewayError(f"Payment gateway request failed: {e}") from e
+            if not retryable or attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise error
+            time.sleep(random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt)))
+            attempt += 1
+
+        try:
+            body = response.json() if response.content else {}
+        except ValueError:
+            # e.g. an HTML error page from a proxy in front of the gateway
+            body = None
+        if response.status_code >= 400:
+            # A 4xx is our request's fault, not the gateway's, so it does not trip the breaker
+            self.breaker.record_success()
+            errors = body.get('errors', []) if isinstance(body, dict) else []
+            detail = '; '.join(e.get('detail', '') for e in errors if isinstance(e, dict)) or response.reason
+            raise PaymentGatewayError(f"Payment gateway rejected the request: {detail}")
+        if not isinstance(body, dict):
+            self.breaker.record_failure()
+            raise PaymentGatewayError(f"Payment gateway returned a malformed response (HTTP {response.status_code})")
+        self.breaker.record_success()
+        return body.get('data', body)
+
+    def create_checkout_session(self, order, payment_method, success_url, cancel_url):
+        """Hosted checkout page for `order`; returns PayMongo's checkout_session resource."""
+        payload = {'data': {'attributes': {
+            'line_items': [{'name': f'Order #{order.id}', 'quantity': 1, 'currency': 'PHP',
+                            'amount': int(round(order.total_amount * 100))}],
+            'payment_method_types': [payment_method],
+            'reference_number': str(order.id),
+            'success_url': success_url,
+            'cancel_url': cancel_url,
+            'send_email_receipt': False,
+        }}}
+        checkout_session = self._request('POST', '/checkout_sessions', payload,
+                                         idempotency_key=f"order-{order.id}-{payment_method}")
+        attributes = checkout_session.get('attributes') if isinstance(checkout_session, dict) else None
+        if not isinstance(attributes, dict) or not checkout_session.get('id') or not attributes.get('checkout_url'):
+            raise PaymentGatewayError('Payment gateway returned a checkout session without an id or checkout_url')
+        return checkout_session
+
+    def retrieve_checkout_session(self, session_id):
+        return self._request('GET', f'/checkout_sessions/{session_id}')
+
+
+# PayMongo's name for each e-wallet option on the payment page
+GATEWAY_PAYMENT_TYPES = {'gcash': 'gcash', 'maya': 'paymaya', 'paymaya': 'paymaya'}
+
+payment_gateway = PayMongoClient.from_env()
+
+
+# ---------------------------------------------------------------------------
+# Payment webhooks
+# ---------------------------------------------------------------------------
+
+PAYMENT_WEBHOOK_TOLERANCE_SECONDS = 300
+PAYMENT_EVENT_MAX_ATTEMPTS = 5
+# Webhook event type -> payment_status it moves the order to
+PAYMENT_EVENT_STATUSES = {
+    'checkout_session.payment.paid': 'Paid',
+    'payment.paid': 'Paid',
+    'payment.failed': 'Failed',
+}
+# Money has arrived: 'Refund Due' is a payment for a released order whose stock
+# could not be taken again; it stays on the order for an admin to refund
+SETTLED_PAYMENT_STATUSES = ('Paid', 'Refund Due')
+
+
+def verify_webhook_signature(payload, header, secret, tolerance=PAYMENT_WEBHOOK_TOLERANCE_SECONDS):
+    """Check a PayMongo-Signature header ("t=<ts>,te=<test sig>,li=<live sig>") against the raw body."""
+    if not secret or not header:
+        return False
+    parts = dict(item.split('=', 1) for item in header.split(',') if '=' in item)
+    try:
+        timestamp = int(parts.get('t', ''))
+    except ValueError:
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    expected = hmac.new(secret.encode('utf-8'), f"{timestamp}.".encode('utf-8') + payload, hashlib.sha256).hexdigest()
+    return any(hmac.compare_digest(expected, parts[key]) for key in ('te', 'li') if parts.get(key))
+
+
+def payment_event_reference(resource):
+    """The id an order stores in payment_reference for the resource an event is about."""
+    attributes = resource.get('attributes') or {}
+    return attributes.get('checkout_session_id') or resource.get('id')
+
+
+def apply_payment_event(event):
+    """Move the referenced order to the event's payment status; a no-op when it is already there.
+
+    Returns False if the event does not concern any order we know about.
+    """
+    order = Order.query.filter_by(payment_reference=event.payment_reference) \
+        .with_for_update().first() if event.payment_reference else None
+    if order is None:
+        return False
+
+    new_status = PAYMENT_EVENT_STATUSES[event.event_type]
+    if order.payment_status in SETTLED_PAYMENT_STATUSES:
+        # Late or repeated deliveries never undo a confirmed payment
+        return True
+    if new_status == 'Paid':
+        order.reserved_until = None
+        if order.status in RELEASED_ORDER_STATUSES:
+            # The reservation lapsed (or the order was cancelled) before the money arrived
+            retake = db.session.begin_nested()
+            if not retake_order_stock(order):
+                retake.rollback()
+                order.payment_status = 'Refund Due'
+                app.logger.warning(f"Order {order.id} was paid after it was {order.status.lower()} and its "
+                                   f"stock is gone; refund required")
+                return True
+            retake.commit()
+            order.status = 'Pending'
+        order.payment_status = 'Paid'
+        if order.status == 'Pending':
+            order.status = 'Processing'
+    else:
+        order.payment_status = new_status
+    return True
+
+
+def process_payment_events(batch_size=100):
+    """Apply queued webhook events in arrival order; returns how many were handled.
+
+    Events are locked with SKIP LOCKED so several workers can share the queue.
+    """
+    events = PaymentEvent.query.filter(PaymentEvent.status == 'Pending') \
+        .order_by(PaymentEvent.id).limit(batch_size).with_for_update(skip_locked=True).all()
+    for event in events:
+        event.attempts += 1
+        try:
+            with db.session.begin_nested():
+                applied = apply_payment_event(event)
+            event.status = 'Processed' if applied else 'Ignored'
+            event.processed_at = datetime.utcnow()
+            event.last_error = None
+        except Exception as e:
+            event.last_error = str(e)[:500]
+            if event.attempts >= PAYMENT_EVENT_MAX_ATTEMPTS:
+                event.status = 'Failed'
+                app.logger.error(f"Payment event {event.event_id} failed permanently: {e}")
+    db.session.commit()
+    return len(events)
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+# With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty,
+# writable directory before start-up (gunicorn.conf.py clears it); each
+# worker then writes its samples there and /metrics aggregates them.
+# /metrics answers only with METRICS_TOKEN as a bearer token; METRICS_PUBLIC=1
+# opens it when it is only reachable on an internal listener.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', '').lower() in ('1', 'true', 'yes')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _NullMetric:
+    """Stands in for every metric when prometheus_client is not installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+
+if prometheus_client is not None:
+    HTTP_REQUESTS = prometheus_client.Counter(
+        'shop_http_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status'])
+    HTTP_LATENCY = prometheus_client.Histogram(
+        'shop_http_request_duration_seconds', 'Time to build the response', ['endpoint'], buckets=LATENCY_BUCKETS)
+    ORDERS_CREATED = prometheus_client.Counter('shop_orders_created_total', 'Orders placed through checkout')
+    CHECKOUT_FAILURES = prometheus_client.Counter(
+        'shop_checkout_failures_total', 'Checkout attempts that did not create an order', ['reason'])
+    EMAILS_SENT = prometheus_client.Counter('shop_emails_total', 'Email delivery attempts', ['result'])
+    STOCK_OUTS = prometheus_client.Counter(
+        'shop_stock_outs_total', 'Product sizes sold down to zero by a checkout')
+    CART_SIZE = prometheus_client.Histogram(
+        'shop_checkout_cart_items', 'Units in the cart when an order is placed',
+        buckets=(1, 2, 3, 5, 10, 20, 50))
+    DB_POOL_CONNECTS = prometheus_client.Counter(
+        'shop_db_pool_connections_opened_total', 'New database connections opened by the pool')
+    DB_POOL_IN_USE = prometheus_client.Gauge(
+        'shop_db_pool_checked_out', 'Pooled database connections currently checked out',
+        multiprocess_mode='livesum')
+    DB_POOL_HOLD = prometheus_client.Histogram(
+        'shop_db_pool_hold_seconds', 'How long a pooled database connection stays checked out',
+        buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+else:
+    HTTP_REQUESTS = HTTP_LATENCY = ORDERS_CREATED = CHECKOUT_FAILURES = EMAILS_SENT = STOCK_OUTS = \
+        CART_SIZE = DB_POOL_CONNECTS = DB_POOL_IN_USE = DB_POOL_HOLD = _NullMetric()
+
+
+class CheckoutError(ValueError):
+    """A checkout problem shown to the customer; `reason` is the metrics label."""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def instrument_pool(engine):
+    """Count connections opened and checked out, and time each checkout, through pool events.
+
+    Checked-out connections close to pool_size + max_overflow mean requests
+    are queueing for one.
+    """
+    def on_connect(dbapi_connection, connection_record):
+        DB_POOL_CONNECTS.inc()
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checked_out_at'] = time.perf_counter()
+        DB_POOL_IN_USE.inc()
+
+    def on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop('checked_out_at', None)
+        if started is not None:
+            DB_POOL_IN_USE.dec()
+            DB_POOL_HOLD.observe(time.perf_counter() - started)
+
+    event.listen(engine, 'connect', on_connect)
+    event.listen(engine, 'checkout', on_checkout)
+    event.listen(engine, 'checkin', on_checkin)
+
+
+if prometheus_client is not None:
+    with app.app_context():
+        instrument_pool(db.engine)
+
+
+@app.before_request
+def start_request_metrics():
+    g._metrics_started = time.perf_counter()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    return response
+
+
+# ---------------------------------------------------------------------------
+# Request profiling
+# ---------------------------------------------------------------------------
+
+# Opt-in: PROFILING_ENABLED=True adds engine listeners and per-request bookkeeping
+app.config['PROFILING_ENABLED'] = os.getenv('PROFILING_ENABLED', 'False').lower() == 'true'
+app.config['PROFILING_WINDOW'] = int(os.getenv('PROFILING_WINDOW', 1000))
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', 10))
+
+PROFILE_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))]
+
+
+class RequestProfiler:
+    """Keeps the last `window` requests per endpoint and summarizes them on demand."""
+
+    def __init__(self, window):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, wall_ms, sql_count, sql_ms, rows):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append((wall_ms, sql_count, sql_ms, rows))
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        with self._lock:
+            snapshot = {endpoint: list(samples) for endpoint, samples in self._samples.items()}
+
+        report = {}
+        for endpoint, samples in snapshot.items():
+            walls = sorted(sample[0] for sample in samples)
+            sql_counts = [sample[1] for sample in samples]
+            sql_times = sorted(sample[2] for sample in samples)
+            rows = [sample[3] for sample in samples]
+            histogram = {f"<={bound}": bisect.bisect_right(walls, bound) for bound in PROFILE_BUCKETS_MS}
+            histogram['+Inf'] = len(walls)
+            report[endpoint] = {
+                'requests': len(samples),
+                'wall_ms': {'p50': round(percentile(walls, 50), 2), 'p95': round(percentile(walls, 95), 2),
+                            'p99': round(percentile(walls, 99), 2), 'max': round(walls[-1], 2)},
+                'sql_count': {'mean': round(sum(sql_counts) / len(samples), 2), 'max': max(sql_counts)},
+                'sql_ms': {'mean': round(sum(sql_times) / len(samples), 2),
+                           'p95': round(percentile(sql_times, 95), 2)},
+                'rows': {'mean': round(sum(rows) / len(samples), 2), 'max': max(rows)},
+                # Cumulative, like Prometheus buckets
+                'histogram_ms': histogram,
+            }
+        return dict(sorted(report.items(), key=lambda item: item[1]['wall_ms']['p95'], reverse=True))
+
+
+request_profiler = RequestProfiler(app.config['PROFILING_WINDOW'])
+
+
+def _profile_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profile_started = time.perf_counter()
+
+
+def _profile_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    profile = g.get('_profile')
+    if profile is None:
+        return
+    profile['sql_count'] += 1
+    profile['sql_ms'] += (time.perf_counter() - context._profile_started) * 1000
+    # Rows returned where the driver reports them for SELECTs (PyMySQL does, sqlite3 does not)
+    if cursor.description is not None and cursor.rowcount > 0:
+        profile['rows'] += cursor.rowcount
+    profile['statements'][statement] += 1
+
+
+if app.config['PROFILING_ENABLED']:
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _profile_before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _profile_after_cursor_execute)
+
+
+@app.before_request
+def start_request_profile():
+    if app.config['PROFILING_ENABLED']:
+        g._profile = {'started': time.perf_counter(), 'sql_count': 0, 'sql_ms': 0.0, 'rows': 0,
+                      'statements': Counter()}
+
+
+@app.after_request
+def finish_request_profile(response):
+    """Record the request; time spent streaming a response body afterwards is not included."""
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return response
+
+    wall_ms = (time.perf_counter() - profile['started']) * 1000
+    endpoint = request.endpoint or 'unmatched'
+    request_profiler.record(endpoint, wall_ms, profile['sql_count'], profile['sql_ms'], profile['rows'])
+
+    if profile['statements']:
+        statement, repeats = profile['statements'].most_common(1)[0]
+        if repeats >= app.config['N_PLUS_ONE_THRESHOLD']:
+            app.logger.warning(f"Possible N+1 in {endpoint}: {repeats} executions of "
+                               f"{' '.join(statement.split())[:300]}")
+
+    response.headers['Server-Timing'] = (f'app;dur={wall_ms:.1f}, '
+                                         f'db;dur={profile["sql_ms"]:.1f};desc="{profile["sql_count"]} queries"')
+    return response
+
+
+# ---------------------------------------------------------------------------
+# Slow query log
+# ---------------------------------------------------------------------------
+
+# Statements slower than SLOW_QUERY_MS are logged, fingerprinted and explained; unset disables it
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS') or 0) or None
+app.config['SLOW_QUERY_WINDOW'] = int(os.getenv('SLOW_QUERY_WINDOW', 500))
+# A fingerprint's plan is captured again at most this often
+SLOW_QUERY_EXPLAIN_SECONDS = 600
+SLOW_QUERY_MAX_FINGERPRINTS = 500
+
+_SQL_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_SQL_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SQL_PLACEHOLDER_RE = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_SQL_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SQL_VALUES_RE = re.compile(r'(VALUES\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+', re.IGNORECASE)
+
+
+def normalize_sql(statement):
+    """Reduce a statement to its shape: literals and bound values become ?, lists collapse."""
+    normalized = _SQL_STRING_RE.sub('?', statement)
+    normalized = _SQL_PLACEHOLDER_RE.sub('?', normalized)
+    normalized = _SQL_NUMBER_RE.sub('?', normalized)
+    normalized = _SQL_LIST_RE.sub('(...)', normalized)
+    normalized = _SQL_VALUES_RE.sub(r'\1', normalized)
+    return ' '.join(normalized.split())
+
+
+def sql_fingerprint(statement):
+    return hashlib.sha1(normalize_sql(statement).encode('utf-8')).hexdigest()[:16]
+
+
+def explain_statement(dbapi_connection, dialect_name, statement, parameters):
+    """EXPLAIN a statement on the connection that ran it; returns a list of row dicts."""
+    if dialect_name == 'mysql':
+        explain = 'EXPLAIN ' + statement
+    elif dialect_name == 'sqlite':
+        explain = 'EXPLAIN QUERY PLAN ' + statement
+    else:
+        return None
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(explain, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+_SQLITE_PLAN_INDEX_RE = re.compile(r'USING (COVERING )?INDEX (\w+)')
+
+
+def plan_summary(plan):
+    """Indexes used, and whether rows are sorted outside an index, from MySQL or SQLite EXPLAIN rows."""
+    indexes, filesort, covering = [], False, bool(plan)
+    for row in plan or []:
+        if 'Extra' in row:
+            extra = row['Extra'] or ''
+            if row.get('key'):
+                indexes.append(row['key'])
+            filesort = filesort or 'Using filesort' in extra
+            covering = covering and 'Using index' in extra
+        elif 'detail' in row:
+            match = _SQLITE_PLAN_INDEX_RE.search(row['detail'])
+            if match:
+                indexes.append(match.group(2))
+            filesort = filesort or 'TEMP B-TREE' in row['detail']
+            if row['detail'].startswith(('SCAN', 'SEARCH')):
+                covering = covering and match is not None and match.group(1) is not None
+        else:
+            return {'indexes': [], 'filesort': None, 'covering': None}
+    return {'indexes': indexes, 'filesort': filesort, 'covering': covering}
+
+
+class SlowQueryLog:
+    """Per-fingerprint counts, recent durations and the latest plan of slow statements."""
+
+    def __init__(self, window):
+        self.window = window
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, fingerprint, statement, duration_ms, endpoint):
+        """Store one slow execution; returns True when the fingerprint's plan is due for capture."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                if len(self._entries) >= SLOW_QUERY_MAX_FINGERPRINTS:
+                    return False
+                entry = self._entries[fingerprint] = {
+                    'fingerprint': fingerprint, 'normalized': normalize_sql(statement), 'count': 0,
+                    'durations': deque(maxlen=self.window), 'endpoints': Counter(),
+                    'sample': None, 'explain': None, 'explained_at': None, 'last_seen': None,
+                }
+            entry['count'] += 1
+            entry['durations'].append(duration_ms)
+            entry['endpoints'][endpoint] += 1
+            entry['last_seen'] = datetime.utcnow()
+            if entry['sample'] is None or duration_ms >= max(entry['durations']):
+                entry['sample'] = statement
+            due = entry['explained_at'] is None or now - entry['explained_at'] >= SLOW_QUERY_EXPLAIN_SECONDS
+            if due:
+                entry['explained_at'] = now
+            return due
+
+    def set_plan(self, fingerprint, plan):
+        with self._lock:
+            if fingerprint in self._entries:
+                self._entries[fingerprint]['explain'] = plan
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    def report(self):
+        """Fingerprints ordered by total recent time, the likeliest index candidates first."""
+        with self._lock:
+            entries = [dict(entry, durations=sorted(entry['durations']), endpoints=dict(entry['endpoints']))
+                       for entry in self._entries.values()]
+
+        report = []
+        for entry in entries:
+            durations = entry.pop('durations')
+            entry.pop('explained_at')
+            entry['p95_ms'] = round(percentile(durations, 95), 2)
+            entry['max_ms'] = round(durations[-1], 2)
+            entry['total_ms'] = round(sum(durations), 2)
+            entry['last_seen'] = entry['last_seen'].isoformat()
+            entry.update(plan_summary(entry['explain']))
+            report.append(entry)
+        return sorted(report, key=lambda entry: entry['total_ms'], reverse=True)
+
+
+slow_query_log = SlowQueryLog(app.config['SLOW_QUERY_WINDOW'])
+
+
+def _slow_query_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._slow_query_started = time.perf_counter()
+
+
+def _slow_query_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - context._slow_query_started) * 1000
+    if duration_ms < app.config['SLOW_QUERY_MS']:
+        return
+
+    fingerprint = sql_fingerprint(statement)
+    endpoint = (request.endpoint or 'unmatched') if has_request_context() else 'background'
+    app.logger.warning(f"Slow query {duration_ms:.1f} ms [{fingerprint}] in {endpoint}: "
+                       f"{' '.join(statement.split())[:500]}")
+    if not slow_query_log.record(fingerprint, statement, duration_ms, endpoint):
+        return
+
+    # INSERTs have no useful plan; executemany and streamed (unbuffered) results
+    # cannot share the connection with another statement
+    if executemany or context.execution_options.get('stream_results') or \
+            statement.lstrip()[:6].upper() not in ('SELECT', 'UPDATE', 'DELETE'):
+        return
+    try:
+        plan = explain_statement(cursor.connection, conn.dialect.name, statement, parameters)
+    except Exception as e:
+        plan = [{'error': str(e)[:500]}]
+    slow_query_log.set_plan(fingerprint, plan)
+
+
+if app.config['SLOW_QUERY_MS']:
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _slow_query_before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _slow_query_after_cursor_execute)
+
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -395,7 +2261,9 @@ def index():
 def login():
     if 'user_id' in session:
         user = get_current_user()
-        return redirect(url_for('dashboard' if user.role == 'Admin' else 'shop'))
+        if user and user.is_active:
+            return redirect(url_for('dashboard' if user.is_admin else 'shop'))
+        session.clear()
 
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
@@ -524,7 +2392,7 @@ def send_otp():
     </body></html>
     """
 
-    if send_email(email, 'Your OTP Code - Ma Locozz Clothing Store', html_body):
+    if queue_email(email, 'Your OTP Code - Ma Locozz Clothing Store', html_body):
         return jsonify({'success': True, 'message': 'OTP sent to your email.'})
     else:
         return jsonify({'success': True, 'message': f'Email failed. DEBUG OTP: {otp_code}', 'debug': True,
@@ -552,7 +2420,7 @@ def forgot_password():
             <a href="{reset_url}" style="background:#667eea;color:white;padding:10px 20px;text-decoration:none;border-radius:5px;">Reset Password</a>
             <p><strong>This link expires in 1 hour.</strong></p>
             """
-            send_email(email, 'Password Reset - Ma Locozz Clothing Store', html_body)
+            queue_email(email, 'Password Reset - Ma Locozz Clothing Store', html_body)
             flash('If that email exists, a reset link has been sent.', 'success')
         else:
             flash('If that email exists, a reset link has been sent.', 'success')
@@ -598,11 +2466,15 @@ from datetime import datetime
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    total_products = Product.query.filter_by(is_deleted=False).count()
-    total_categories = Category.query.filter_by(is_deleted=False).count()
-    all_products = Product.query.filter_by(is_deleted=False).all()
-    low_stock_count = sum(1 for p in all_products if p.total_quantity < 10)
-    total_value = sum(p.price * p.total_quantity for p in all_products)
+    total_products = count_rows(Product.query.filter_by(is_deleted=False))
+    total_categories = count_rows(Category.query.filter_by(is_deleted=False))
+    stock = db.session.query(ProductSize.product_id, db.func.sum(ProductSize.quantity).label('quantity')) \
+        .group_by(ProductSize.product_id).subquery()
+    stock_qty = db.func.coalesce(stock.c.quantity, 0)
+    low_stock_count, total_value = db.session.query(
+        db.func.coalesce(db.func.sum(db.case((stock_qty < LOW_STOCK_THRESHOLD, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(Product.price * stock_qty), 0)
+    ).outerjoin(stock, stock.c.product_id == Product.id).filter(Product.is_deleted == False).one()
     recent_products = Product.query.filter_by(is_deleted=False).order_by(Product.created_at.desc()).limit(5).all()
 
     return render_template('dashboard.html',
@@ -622,15 +2494,21 @@ def shop():
     search = request.args.get('search', '')
     category_filter = request.args.get('category', '')
     query = Product.query.filter_by(is_deleted=False)
-    if search:
-        query = query.filter((Product.product_code.ilike(f'%{search}%')) | (Product.name.ilike(f'%{search}%')) |
-                             (Product.color.ilike(f'%{search}%')))
+    category_id = None
     if category_filter:
         try:
-            query = query.filter_by(category_id=int(category_filter))
+            category_id = int(category_filter)
+            query = query.filter_by(category_id=category_id)
         except ValueError:
             pass
-    pagination = query.order_by(Product.name).paginate(page=page, per_page=12, error_out=False)
+    if search:
+        query = search_products(query, search, category_id)
+    if not search and use_keyset_pagination():
+        # Search results are ranked by relevance, so only plain browsing seeks on (name, id)
+        pagination = keyset_paginate(query, [Product.name, Product.id], after=request.args.get('after'),
+                                     per_page=12, count_key=('shop', category_filter))
+    else:
+        pagination = query.order_by(Product.name, Product.id).paginate(page=page, per_page=12, error_out=False)
     categories = Category.query.filter_by(is_deleted=False).order_by(Category.name).all()
     return render_template('shop/browse.html', products=pagination.items, pagination=pagination,
                            search=search, category_filter=category_filter, categories=categories)
@@ -682,12 +2560,9 @@ def add_to_cart(product_id):
     else:
         cart[item_key] = {
             'product_id': product.id,
-            'name': product.name,
             'price': float(product.price),
             'quantity': requested_quantity,
-            'product_code': product.product_code,
-            'size': size,
-            'color': product.color
+            'size': size
         }
 
     save_cart(cart)
@@ -699,12 +2574,12 @@ def add_to_cart(product_id):
 @app.route('/cart')
 @login_required
 def view_cart():
-    cart_items = []
     cart = get_cart()
+    products = load_cart_products(cart)
 
     validation_errors = []
     for item_key, item_data in list(cart.items()):
-        product = db.session.get(Product, item_data.get('product_id'))
+        product = products.get(item_data.get('product_id'))
         size = item_data.get('size')
 
         if not product or product.is_deleted or not size:
@@ -720,16 +2595,7 @@ def view_cart():
         flash(", ".join(validation_errors), 'warning')
         save_cart(cart)
 
-    for item_key, item_data in cart.items():
-        product = db.session.get(Product, item_data['product_id'])
-        if product and not product.is_deleted:
-            cart_items.append({
-                'product': product,
-                'quantity': item_data['quantity'],
-                'size': item_data['size'],
-                'subtotal': item_data['price'] * item_data['quantity']
-            })
-
+    cart_items = build_cart_items(cart, products)
     return render_template('shop/cart.html', cart_items=cart_items, total=calculate_cart_total(cart))
 
 
@@ -790,15 +2656,38 @@ def remove_from_cart(product_id):
     return redirect(url_for('view_cart'))
 
 
+def find_checkout_replay(idempotency_key, user_id):
+    """The order a previous submission of the same checkout form created, if any."""
+    if not idempotency_key:
+        return None
+    return Order.query.join(Order.customer) \
+        .filter(Order.idempotency_key == idempotency_key, Customer.user_id == user_id).first()
+
+
+def redirect_to_placed_order(order):
+    session['pending_order_id'] = order.id
+    flash(f'Order #{order.id} has already been placed.', 'info')
+    if order.payment_status == 'Paid':
+        return redirect(url_for('order_confirmation', order_id=order.id))
+    return redirect(url_for('select_payment_method', order_id=order.id))
+
+
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
 def checkout():
+    user = get_current_user()
+    idempotency_key = request.form.get('idempotency_key', '').strip()[:64] or None
+    if request.method == 'POST':
+        # A double-clicked or resubmitted form returns the order the first submission made
+        replayed = find_checkout_replay(idempotency_key, user.id)
+        if replayed:
+            return redirect_to_placed_order(replayed)
+
     cart = get_cart()
     if not cart:
         flash('Your cart is empty.', 'warning')
         return redirect(url_for('shop'))
 
-    user = get_current_user()
     customer = Customer.query.filter_by(user_id=user.id, is_deleted=False).first()
 
     if request.method == 'POST':
@@ -819,9 +2708,11 @@ def checkout():
             errors.append('Address required.')
 
         if errors:
+            CHECKOUT_FAILURES.labels('invalid_form').inc()
             for error in errors:
                 flash(error, 'danger')
-            return render_template('shop/checkout.html', form_data=request.form, customer=customer)
+            return render_template('shop/checkout.html', form_data=request.form, customer=customer,
+                                   idempotency_key=idempotency_key or uuid.uuid4().hex)
 
 
         try:
@@ -829,6 +2720,7 @@ def checkout():
                 customer = Customer(first_name=first_name, last_name=last_name, email=email, phone=phone,
                                     address=address, user_id=user.id)
                 db.session.add(customer)
+                db.session.flush()
             else:
                 customer.first_name = first_name
                 customer.last_name = last_name
@@ -841,61 +2733,70 @@ def checkout():
                 customer_id=customer.id,
                 total_amount=total_amount,
                 status='Pending',
-                payment_status='Unpaid'
+                payment_status='Unpaid',
+                reserved_until=reservation_deadline(),
+                idempotency_key=idempotency_key
             )
             db.session.add(order)
+            # A concurrent submission with the same key fails here on the unique index
             db.session.flush()
 
-            # Process order details and update inventory
-            for item_key, item_data in cart.items():
-                product = db.session.get(Product, item_data['product_id'])
+            # Process order details and update inventory, locking stock rows in product-id order
+            products = load_cart_products(cart)
+            lines = sorted(cart.items(), key=lambda entry: (entry[1]['product_id'], entry[1].get('size') or ''))
+            available = lock_stock((item_data['product_id'], item_data['size'])
+                                   for _, item_data in lines if item_data.get('size'))
+            taken, details = {}, []
+            for item_key, item_data in lines:
+                product = products.get(item_data['product_id'])
                 size = item_data.get('size')
                 quantity = item_data['quantity']
 
                 if not product or not size or size not in product.size_quantities:
-                    raise ValueError(f"Invalid product or size: {item_key}")
-
-                available_qty = product.size_quantities[size]
-                if available_qty < quantity:
-                    raise ValueError(f"Insufficient stock for {product.name} (Size: {size})")
-
-
-                db.session.add(OrderDetail(
-                    order_id=order.id,
-                    product_id=product.id,
-                    size=size,
-                    quantity=quantity,
-                    price=item_data['price']
-                ))
-
-                # Update inventory
-                product.size_quantities[size] -= quantity
-                sqlalchemy.orm.attributes.flag_modified(product, 'size_quantities')
-
+                    raise CheckoutError(f"Invalid product or size: {item_key}", 'invalid_item')
+
+                taken[(product.id, size)] = taken.get((product.id, size), 0) + quantity
+                if available.get((product.id, size), 0) < taken[(product.id, size)]:
+                    raise CheckoutError(f"Insufficient stock for {product.name} (Size: {size})",
+                                        'insufficient_stock')
+
+                details.append({
+                    'order_id': order.id,
+                    'product_id': product.id,
+                    'size': size,
+                    'quantity': quantity,
+                    'price': item_data['price']
+                })
+
+            # One UPDATE for all stock rows and one multi-row INSERT for the lines;
+            # order.order_details loads them on first access after the commit
+            if not take_stock(taken):
+                raise CheckoutError("Some items just went out of stock. Please review your cart.", 'stock_race')
+            db.session.execute(db.insert(OrderDetail), details)
             db.session.commit()
+            ORDERS_CREATED.inc()
+            CART_SIZE.observe(sum(taken.values()))
+            STOCK_OUTS.inc(sum(1 for key, quantity in taken.items() if available[key] == quantity))
             session['pending_order_id'] = order.id
             return redirect(url_for('select_payment_method', order_id=order.id))
 
+        except IntegrityError:
+            db.session.rollback()
+            replayed = find_checkout_replay(idempotency_key, user.id)
+            if replayed:
+                return redirect_to_placed_order(replayed)
+            CHECKOUT_FAILURES.labels('conflict').inc()
+            flash('Your order could not be placed. Please try again.', 'danger')
+            return redirect(url_for('view_cart'))
         except Exception as e:
             db.session.rollback()
+            CHECKOUT_FAILURES.labels(e.reason if isinstance(e, CheckoutError) else 'error').inc()
             flash(str(e), 'danger')
             return redirect(url_for('view_cart'))
 
-    # Prepare cart items for display
-    cart_items = []
-    for item_key, item_data in cart.items():
-        product = db.session.get(Product, item_data['product_id'])
-        size = item_data.get('size')
-        if product and not product.is_deleted and size:
-            cart_items.append({
-                'product': product,
-                'quantity': item_data['quantity'],
-                'size': size,
-                'subtotal': item_data['price'] * item_data['quantity']
-            })
-
+    cart_items = build_cart_items(cart, load_cart_products(cart))
     return render_template('shop/checkout.html', cart_items=cart_items, total=calculate_cart_total(cart),
-                           customer=customer)
+                           customer=customer, idempotency_key=uuid.uuid4().hex)
 
 
 @app.route('/payment/select/<int:order_id>')
@@ -917,14 +2818,20 @@ def select_payment_method(order_id):
         flash('This order has already been paid.', 'info')
         return redirect(url_for('order_confirmation', order_id=order.id))
 
-    return render_template('shop/payment_select.html', order=order)
+    if order.status in RELEASED_ORDER_STATUSES:
+        flash(f'Order #{order.id} is {order.status.lower()} and can no longer be paid.', 'warning')
+        return redirect(url_for('my_orders'))
+
+    return render_template('shop/payment_select.html', order=order,
+                           reserved_statuses=RESERVED_PAYMENT_STATUSES)
 
 
 @app.route('/payment/process/<int:order_id>', methods=['POST'])
 @login_required
 def process_payment(order_id):
     payment_method = request.form.get('payment_method')
-    order = db.session.get(Order, order_id)
+    # Locked so the reservation sweeper cannot expire the order underneath us
+    order = db.session.get(Order, order_id, with_for_update=True)
 
     if not order:
         flash('Order not found.', 'danger')
@@ -937,6 +2844,14 @@ def process_payment(order_id):
         flash('Unauthorized access to order.', 'danger')
         return redirect(url_for('shop'))
 
+    if order.status in RELEASED_ORDER_STATUSES:
+        flash(f'Order #{order.id} is {order.status.lower()} and can no longer be paid.', 'warning')
+        return redirect(url_for('my_orders'))
+
+    if order.payment_status == 'Paid':
+        flash('This order has already been paid.', 'info')
+        return redirect(url_for('order_confirmation', order_id=order.id))
+
     # Validate payment method - includes Maya (new PayMaya brand) and PayMaya for backward compatibility
     valid_methods = ['credit_card', 'gcash', 'maya', 'paymaya', 'bank_transfer', 'cash', 'cod', 'debit']
     if payment_method not in valid_methods:
@@ -965,7 +2880,7 @@ def process_payment(order_id):
 @app.route('/payment/create/<int:order_id>/<payment_method>', methods=['GET'])
 @login_required
 def create_payment_api(order_id, payment_method):
-    order = db.session.get(Order, order_id)
+    order = db.session.get(Order, order_id, with_for_update=True)
 
     if not order:
         flash('Order not found.', 'danger')
@@ -978,20 +2893,48 @@ def create_payment_api(order_id, payment_method):
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('shop'))
 
-    # For now, simulate payment processing
-    # In production, integrate with actual GCash/PayMaya API
+    if payment_method not in GATEWAY_PAYMENT_TYPES:
+        flash('Invalid payment method.', 'danger')
+        return redirect(url_for('select_payment_method', order_id=order.id))
+
+    if order.status in RELEASED_ORDER_STATUSES:
+        flash(f'Order #{order.id} is {order.status.lower()} and can no longer be paid.', 'warning')
+        return redirect(url_for('my_orders'))
+
+    if order.payment_status == 'Paid':
+        flash('This order has already been paid.', 'info')
+        return redirect(url_for('order_confirmation', order_id=order.id))
 
-    if payment_method in ['gcash', 'paymaya']:
-        # Set order as paid (or pending payment confirmation)
+    if not payment_gateway.configured:
+        # No PayMongo keys (local development): simulate the payment being initiated
         order.payment_status = 'Pending'
         db.session.commit()
 
         flash(f'Payment via {payment_method.title()} initiated successfully!', 'success')
         return redirect(url_for('order_confirmation', order_id=order.id))
-    else:
-        flash('Invalid payment method.', 'danger')
+
+    # The stock stays reserved, with a fresh deadline, until the webhook confirms
+    # payment; commit now so the row is not locked while the gateway is called
+    order.payment_method = payment_method
+    order.payment_status = 'Awaiting'
+    order.reserved_until = reservation_deadline()
+    db.session.commit()
+
+    try:
+        checkout_session = payment_gateway.create_checkout_session(
+            order, GATEWAY_PAYMENT_TYPES[payment_method],
+            success_url=url_for('payment_success', order_id=order.id, _external=True),
+            cancel_url=url_for('payment_failed', order_id=order.id, _external=True))
+    except PaymentGatewayError as e:
+        app.logger.error(f"Payment gateway error for order {order.id}: {e}")
+        flash('We could not reach the payment provider. Please try again or choose another method.', 'danger')
         return redirect(url_for('select_payment_method', order_id=order.id))
 
+    order = db.session.get(Order, order_id, with_for_update=True, populate_existing=True)
+    order.payment_reference = checkout_session['id']
+    db.session.commit()
+    return redirect(checkout_session['attributes']['checkout_url'])
+
 
 @app.route('/payment/success')
 @login_required
@@ -1003,12 +2946,16 @@ def payment_success():
             customer = db.session.get(Customer, order.customer_id)
             user = get_current_user()
             if customer.user_id == user.id:
-                order.payment_status = 'Paid'
-                order.status = 'Processing'
-                db.session.commit()
-                session.pop('cart', None)
+                if order.payment_reference and payment_gateway.configured:
+                    # The signed webhook confirms gateway payments; the redirect alone proves nothing
+                    flash(f'Thank you! We are confirming the payment for Order #{order.id}.', 'info')
+                else:
+                    order.payment_status = 'Paid'
+                    order.status = 'Processing'
+                    db.session.commit()
+                    flash(f'Payment successful! Order #{order.id} is being processed.', 'success')
+                clear_cart()
                 session.pop('pending_order_id', None)
-                flash(f'Payment successful! Order #{order.id} is being processed.', 'success')
                 return redirect(url_for('order_confirmation', order_id=order.id))
 
     flash('Payment completed successfully!', 'success')
@@ -1020,17 +2967,44 @@ def payment_success():
 def payment_failed():
     order_id = request.args.get('order_id')
     if order_id:
-        order = db.session.get(Order, order_id)
+        order = db.session.get(Order, order_id, with_for_update=True)
         if order:
             customer = db.session.get(Customer, order.customer_id)
             user = get_current_user()
-            if customer.user_id == user.id:
+            if customer.user_id == user.id and order.payment_status not in SETTLED_PAYMENT_STATUSES:
                 order.payment_status = 'Failed'
                 db.session.commit()
     flash('Payment failed. Please try again.', 'danger')
     return redirect(url_for('select_payment_method', order_id=order_id) if order_id else url_for('my_orders'))
 
 
+@app.route('/webhooks/payments', methods=['POST'])
+def payment_webhook():
+    """Verify and enqueue; payment_worker.py applies the event outside the request."""
+    payload = request.get_data()
+    if not verify_webhook_signature(payload, request.headers.get('Paymongo-Signature'),
+                                    os.getenv('PAYMONGO_WEBHOOK_SECRET')):
+        return jsonify({'error': 'invalid signature'}), 401
+
+    try:
+        data = json.loads(payload)['data']
+        event_id, event_type = data['id'], data['attributes']['type']
+        resource = data['attributes'].get('data') or {}
+    except (ValueError, KeyError, TypeError):
+        return jsonify({'error': 'malformed event'}), 400
+    if event_type not in PAYMENT_EVENT_STATUSES:
+        return jsonify({'received': True}), 200
+
+    try:
+        db.session.add(PaymentEvent(event_id=event_id, event_type=event_type,
+                                    payment_reference=payment_event_reference(resource), payload=data))
+        db.session.commit()
+    except IntegrityError:
+        # The gateway redelivered an event we already queued
+        db.session.rollback()
+    return jsonify({'received': True}), 200
+
+
 @app.route('/order/confirmation/<int:order_id>')
 @login_required
 def order_confirmation(order_id):
@@ -1041,7 +3015,7 @@ def order_confirmation(order_id):
             return redirect(url_for('shop'))
 
         # Verify the order belongs to the current user
-        if order.user_id != session.get('user_id'):
+        if order.customer.user_id != session.get('user_id'):
             flash('Unauthorized access.', 'danger')
             return redirect(url_for('my_orders'))
 
@@ -1051,7 +3025,7 @@ def order_confirmation(order_id):
         print(f"Template path: shop/order_confirmation.html")
 
         # Clear cart
-        session.pop('cart', None)
+        clear_cart()
         session.pop('pending_order_id', None)
 
         # Try to render template
@@ -1084,8 +3058,13 @@ def my_orders():
         flash('No customer profile found.', 'warning')
         return redirect(url_for('shop'))
 
-    orders = Order.query.filter_by(customer_id=customer.id, is_deleted=False).order_by(
-        Order.order_date.desc()).all()
+    query = Order.query.filter_by(customer_id=customer.id, is_deleted=False)
+    if use_keyset_pagination():
+        pagination = keyset_paginate(query, [Order.order_date, Order.id], after=request.args.get('after'),
+                                     per_page=20, descending=True)
+        return render_template('shop/orders.html', orders=pagination.items, pagination=pagination)
+
+    orders = query.order_by(Order.order_date.desc(), Order.id.desc()).all()
     return render_template('shop/orders.html', orders=orders)
 
 
@@ -1110,7 +3089,7 @@ def order_detail(order_id):
 @app.route('/order/<int:order_id>/cancel', methods=['POST'])
 @login_required
 def cancel_order(order_id):
-    order = db.session.get(Order, order_id)
+    order = db.session.get(Order, order_id, with_for_update=True)
     if not order:
         flash('Order not found.', 'danger')
         return redirect(url_for('my_orders'))
@@ -1127,14 +3106,9 @@ def cancel_order(order_id):
         return redirect(url_for('order_detail', order_id=order_id))
 
     try:
-        # Restore inventory
-        for detail in order.order_details:
-            product = db.session.get(Product, detail.product_id)
-            if product and detail.size in product.size_quantities:
-                product.size_quantities[detail.size] += detail.quantity
-                sqlalchemy.orm.attributes.flag_modified(product, 'size_quantities')
-
+        restock_order(order)
         order.status = 'Cancelled'
+        order.reserved_until = None
         db.session.commit()
         flash(f'Order #{order.id} cancelled successfully.', 'success')
     except Exception as e:
@@ -1144,6 +3118,142 @@ def cancel_order(order_id):
     return redirect(url_for('my_orders'))
 
 
+ORDER_STATUSES = ['Pending', 'Processing', 'Completed', 'Cancelled', 'Expired']
+PAYMENT_STATUSES = ['Unpaid', 'Awaiting', 'Pending', 'Paid', 'Failed', 'Refund Due']
+
+
+@app.route('/admin/orders')
+@admin_required
+def admin_orders():
+    page = request.args.get('page', 1, type=int)
+    status_filter = request.args.get('status', '')
+    payment_filter = request.args.get('payment_status', '')
+
+    filtered = Order.query.filter(Order.is_deleted == False)
+    if status_filter:
+        filtered = filtered.filter(Order.status == status_filter)
+    if payment_filter:
+        filtered = filtered.filter(Order.payment_status == payment_filter)
+
+    # Counted per row of the page from the order_id index, rather than grouping every order line
+    item_count = db.select(db.func.count(OrderDetail.id)).where(OrderDetail.order_id == Order.id) \
+        .correlate(Order).scalar_subquery()
+    query = filtered.join(Order.customer) \
+        .options(db.contains_eager(Order.customer), db.with_expression(Order.item_count, item_count))
+
+    if use_keyset_pagination():
+        pagination = keyset_paginate(query, [Order.order_date, Order.id], after=request.args.get('after'),
+                                     per_page=25, descending=True, count_query=filtered,
+                                     count_key=('admin_orders', status_filter, payment_filter))
+    else:
+        pagination = query.order_by(Order.order_date.desc(), Order.id.desc()) \
+            .paginate(page=page, per_page=25, error_out=False)
+
+    status_counts = dict(db.session.query(Order.status, db.func.count(Order.id))
+                         .filter(Order.is_deleted == False).group_by(Order.status).all())
+    return render_template('admin/orders.html', orders=pagination.items, pagination=pagination,
+                           status_counts=status_counts, statuses=ORDER_STATUSES,
+                           payment_statuses=PAYMENT_STATUSES,
+                           status_filter=status_filter, payment_filter=payment_filter)
+
+
+@app.route('/admin/orders/<int:order_id>/status', methods=['POST'])
+@admin_required
+def update_order_status(order_id):
+    order = db.session.get(Order, order_id, with_for_update=True)
+    status = request.form.get('status', '')
+    if not order or status not in ORDER_STATUSES:
+        flash('Invalid order or status.', 'danger')
+        return redirect(url_for('admin_orders'))
+
+    try:
+        if status in RELEASED_ORDER_STATUSES and order.status not in RELEASED_ORDER_STATUSES:
+            restock_order(order)
+            order.reserved_until = None
+        elif order.status in RELEASED_ORDER_STATUSES and status not in RELEASED_ORDER_STATUSES:
+            # Its stock went back on the shelf when it was cancelled or expired
+            if not retake_order_stock(order):
+                db.session.rollback()
+                flash(f'Not enough stock to reopen order #{order_id}.', 'danger')
+                return redirect(url_for('admin_orders'))
+        order.status = status
+        db.session.commit()
+        flash(f'Order #{order.id} status changed to {status}.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('Error updating order status.', 'danger')
+    return redirect(url_for('admin_orders'))
+
+
+@app.route('/admin/orders/<int:order_id>/cancel', methods=['POST'])
+@admin_required
+def admin_cancel_order(order_id):
+    order = db.session.get(Order, order_id, with_for_update=True)
+    if not order or order.status in RELEASED_ORDER_STATUSES:
+        flash('Order not found or already cancelled.', 'danger')
+        return redirect(url_for('admin_orders'))
+
+    try:
+        restock_order(order)
+        order.status = 'Cancelled'
+        order.reserved_until = None
+        db.session.commit()
+        flash(f'Order #{order.id} cancelled successfully.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('Error cancelling order.', 'danger')
+    return redirect(url_for('admin_orders'))
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition, aggregated across workers in multiprocess mode."""
+    if prometheus_client is None:
+        return Response('prometheus_client is not installed\n', status=503, mimetype='text/plain')
+    if not METRICS_TOKEN:
+        if not METRICS_PUBLIC:
+            abort(404)
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        abort(401)
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+
+@app.route('/admin/profiling')
+@admin_required
+def profiling_report():
+    """Rolling per-endpoint latency and SQL statistics, slowest p95 first."""
+    return jsonify({'enabled': app.config['PROFILING_ENABLED'], 'window': request_profiler.window,
+                    'endpoints': request_profiler.summary()})
+
+
+@app.route('/admin/profiling/reset', methods=['POST'])
+@admin_required
+def reset_profiling():
+    # POST only: with the SameSite=Lax session cookie a cross-site form or link cannot reach it
+    request_profiler.reset()
+    return jsonify({'reset': True})
+
+
+@app.route('/admin/slow-queries')
+@admin_required
+def slow_query_report():
+    """Slow statement fingerprints with counts, p95 and their latest EXPLAIN plan."""
+    return jsonify({'threshold_ms': app.config['SLOW_QUERY_MS'], 'queries': slow_query_log.report()})
+
+
+@app.route('/admin/slow-queries/reset', methods=['POST'])
+@admin_required
+def reset_slow_queries():
+    # POST only, like reset_profiling
+    slow_query_log.reset()
+    return jsonify({'reset': True})
+
+
 @app.route('/categories')
 @login_required
 def list_categories():
@@ -1203,7 +3313,7 @@ def delete_category(id):
         flash('Category not found.', 'danger')
         return redirect(url_for('list_categories'))
 
-    active_products = Product.query.filter_by(category_id=id, is_deleted=False).count()
+    active_products = count_rows(Product.query.filter_by(category_id=id, is_deleted=False))
     if active_products > 0:
         flash(f'Cannot delete. Category has {active_products} products.', 'danger')
         return redirect(url_for('list_categories'))
@@ -1224,6 +3334,8 @@ def delete_product(id):
 
     product.is_deleted = True
     db.session.commit()
+    search_backend.remove_product(product.id)
+    forget_product_image(product.id)
     flash(f'Product "{product.name}" deleted successfully!', 'success')
     return redirect(url_for('list_products'))
 
@@ -1238,15 +3350,21 @@ def list_products():
     search = request.args.get('search', '')
     category_filter = request.args.get('category', '')
     query = Product.query.filter_by(is_deleted=False)
-    if search:
-        query = query.filter((Product.product_code.ilike(f'%{search}%')) | (Product.name.ilike(f'%{search}%')) |
-                             (Product.color.ilike(f'%{search}%')))
+    category_id = None
     if category_filter:
         try:
-            query = query.filter_by(category_id=int(category_filter))
+            category_id = int(category_filter)
+            query = query.filter_by(category_id=category_id)
         except ValueError:
             pass
-    pagination = query.order_by(Product.name).paginate(page=page, per_page=10, error_out=False)
+    if search:
+        query = search_products(query, search, category_id)
+    if not search and use_keyset_pagination():
+        # Search results are ranked by relevance, so only plain browsing seeks on (name, id)
+        pagination = keyset_paginate(query, [Product.name, Product.id], after=request.args.get('after'),
+                                     per_page=10, count_key=('products', category_filter))
+    else:
+        pagination = query.order_by(Product.name, Product.id).paginate(page=page, per_page=10, error_out=False)
     categories = Category.query.filter_by(is_deleted=False).order_by(Category.name).all()
     return render_template('products/list.html', products=pagination.items, pagination=pagination,
                            search=search, category_filter=category_filter, categories=categories)
@@ -1268,23 +3386,18 @@ def create_product():
         color = request.form.get('color', '').strip()
         price = request.form.get('price', '')
 
-        # Get size quantities - Store as JSON
+        # Get size quantities
         size_quantities = {}
         has_any_quantity = False
 
         for key, value in request.form.items():
             if key.startswith('shirt_sizes[') or key.startswith('pant_sizes['):
-                # Extract size type and value
-                if key.startswith('shirt_sizes['):
-                    size_type = 'shirt'
-                    size_value = key.split('[')[1].split(']')[0]
-                else:
-                    size_type = 'pant'
-                    size_value = key.split('[')[1].split(']')[0]
+                # Extract size value (shirt and pant sizes share one namespace)
+                size_value = key.split('[')[1].split(']')[0]
 
                 quantity = int(value) if value.isdigit() else 0
-                if quantity > 0:
-                    size_quantities[f"{size_type}_{size_value}"] = quantity
+                if quantity > 0 and size_value in VALID_SIZES:
+                    size_quantities[size_value] = quantity
                     has_any_quantity = True
 
         # Validation errors list
@@ -1330,10 +3443,10 @@ def create_product():
             if not allowed_file(image_file.filename):
                 errors.append("Invalid image file type")
             else:
-                # Save image
-                ext = image_file.filename.rsplit('.', 1)[1].lower()
-                image_filename = f"{uuid.uuid4().hex}.{ext}"
-                image_file.save(os.path.join(app.config['UPLOAD_FOLDER'], image_filename))
+                # Save image and its renditions
+                image_filename = save_product_image(image_file)
+                if not image_filename:
+                    errors.append("Image could not be processed")
 
         # If validation errors, render form again with errors
         if errors:
@@ -1343,7 +3456,7 @@ def create_product():
                                    errors=errors,
                                    form_data=request.form)
 
-        # Create product with size_quantities as JSON
+        # Create product with one product_size row per stocked size
         product = Product(
             product_code=product_code,
             name=name,
@@ -1352,11 +3465,12 @@ def create_product():
             color=color,
             price=float(price),
             image_filename=image_filename,
-            size_quantities=size_quantities  # Store as JSON
+            size_quantities=size_quantities
         )
 
         db.session.add(product)
         db.session.commit()
+        search_backend.index_product(product)
 
         flash('Product created successfully!', 'success')
         return redirect(url_for('list_products'))
@@ -1399,23 +3513,17 @@ def edit_product(id):
             if 'image' in request.files:
                 file = request.files['image']
                 if file and file.filename:
-                    from werkzeug.utils import secure_filename
-                    import os
-                    import time
-
-                    filename = secure_filename(file.filename)
-                    filename = f"{int(time.time())}_{filename}"
-
-                    upload_folder = os.path.join(app.root_path, 'static', 'uploads', 'products')
-                    os.makedirs(upload_folder, exist_ok=True)
-
-                    filepath = os.path.join(upload_folder, filename)
-                    file.save(filepath)
-
+                    if not allowed_file(file.filename):
+                        raise ValueError("Invalid image file type")
+                    filename = save_product_image(file)
+                    if not filename:
+                        raise ValueError("Image could not be processed")
                     product.image_filename = filename
 
             product.updated_at = datetime.utcnow()
             db.session.commit()
+            search_backend.index_product(product)
+            forget_product_image(product.id)
             flash('Product updated successfully!', 'success')
             return redirect(url_for('view_product', id=product.id))
 
@@ -1434,41 +3542,81 @@ def edit_product(id):
 @app.route('/products/export')
 @login_required
 def export_products():
-    products = Product.query.filter_by(is_deleted=False).order_by(Product.name).all()
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Product Code', 'Name', 'Category', 'Color', 'Price', 'Size Breakdown',
-                     'Total Quantity', 'Total Value'])
-    for product in products:
-        size_breakdown = str(product.size_quantities) if product.size_quantities else 'N/A'
-        total_qty = product.total_quantity
-        writer.writerow([product.product_code, product.name, product.category.name, product.color,
-                         f'{product.price:.2f}', size_breakdown, total_qty,
-                         f'{product.price * total_qty:.2f}'])
-    output.seek(0)
-    return send_file(BytesIO(output.getvalue().encode('utf-8')), mimetype='text/csv', as_attachment=True,
-                     download_name=f'products_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+    size_list = db.func.group_concat(ProductSize.size + ':' + db.cast(ProductSize.quantity, db.String))
+    rows = db.session.query(
+        Product.product_code, Product.name, Category.name.label('category_name'), Product.color, Product.price,
+        size_list.label('sizes'),
+        db.cast(db.func.coalesce(db.func.sum(ProductSize.quantity), 0), db.Integer).label('total_qty')
+    ).join(Category, Category.id == Product.category_id) \
+        .outerjoin(ProductSize, ProductSize.product_id == Product.id) \
+        .filter(Product.is_deleted == False) \
+        .group_by(Product.id, Category.name) \
+        .order_by(Product.name, Product.id) \
+        .yield_per(1000)
+
+    def generate():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Product Code', 'Name', 'Category', 'Color', 'Price', 'Size Breakdown',
+                         'Total Quantity', 'Total Value'])
+        for count, row in enumerate(rows, 1):
+            size_breakdown = 'N/A'
+            if row.sizes:
+                size_breakdown = str({size: int(qty) for size, qty in
+                                      (pair.rsplit(':', 1) for pair in row.sizes.split(','))})
+            total_qty = int(row.total_qty)
+            writer.writerow([row.product_code, row.name, row.category_name, row.color, f'{row.price:.2f}',
+                             size_breakdown, total_qty, f'{row.price * total_qty:.2f}'])
+            if count % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    filename = f'products_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 
 from flask import send_from_directory
 import os
 
 
+def send_product_image(filename, max_age):
+    """Send an uploaded image with a strong ETag; send_file answers If-None-Match with a 304."""
+    match = HASHED_IMAGE_RE.match(filename)
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=max_age, conditional=True,
+                                   etag=filename.replace('/', '-') if match else True)
+    response.cache_control.public = True
+    return response
+
+
+@app.route('/images/products/<path:filename>')
+def product_image_file(filename):
+    """Content-addressed image: the URL changes whenever the bytes do, so it can be cached forever."""
+    if not HASHED_IMAGE_RE.match(filename):
+        abort(404)
+    response = send_product_image(filename, IMAGE_CACHE_SECONDS)
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/product-image/<int:id>')
 def product_image(id):
     """Serve product images with fallback"""
-    product = Product.query.get_or_404(id)
+    image_filename = lookup_product_image(id)
+    if image_filename is None:
+        abort(404)
 
-    if product.image_filename:
-        image_path = os.path.join(app.root_path, 'static', 'uploads', 'products', product.image_filename)
-        if os.path.exists(image_path):
-            return send_from_directory(
-                os.path.join(app.root_path, 'static', 'uploads', 'products'),
-                product.image_filename
-            )
+    if image_filename:
+        try:
+            return send_product_image(image_filename, IMAGE_LOOKUP_SECONDS)
+        except NotFound:
+            pass
 
     # Return placeholder if image doesn't exist
-    return send_from_directory(os.path.join(app.root_path, 'static', 'images'),'placeholder.jpg')
+    return send_from_directory(os.path.join(app.static_folder, 'images'), 'placeholder.png',
+                               max_age=IMAGE_LOOKUP_SECONDS)
 
 
 @app.route('/users')
@@ -1492,6 +3640,7 @@ def toggle_user_role(id):
 
     user.role = 'User' if user.role == 'Admin' else 'Admin'
     db.session.commit()
+    invalidate_principal(user.id)
     flash(f'User {user.username} role changed to {user.role}.', 'success')
     return redirect(url_for('list_users'))
 
@@ -1510,6 +3659,7 @@ def deactivate_user(id):
 
     user.is_active = False
     db.session.commit()
+    invalidate_principal(user.id)
     flash(f'User {user.username} has been deactivated.', 'success')
     return redirect(url_for('list_users'))
 
@@ -0,0 +1,69 @@
+import os
+
+from app import app, db, Product, rendition_filename, store_product_image, Image
+
+# Older uploads were written to either of these folders
+LEGACY_FOLDERS = [
+    os.path.join(app.static_folder, 'uploads', 'products'),
+    os.path.join(app.static_folder, 'images', 'products'),
+]
+
+
+def find_original(image_filename):
+    for folder in [app.config['UPLOAD_FOLDER']] + LEGACY_FOLDERS:
+        path = os.path.join(folder, image_filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def backfill_product_images(force=False):
+    if Image is None:
+        print("❌ Pillow is not installed. Run: pip install Pillow")
+        return False
+
+    with app.app_context():
+        print("\n" + "=" * 60)
+        print("🖼️  Generating product image renditions...")
+        print("=" * 60 + "\n")
+
+        processed, missing, failed = 0, 0, 0
+        products = Product.query.filter(Product.image_filename.isnot(None), Product.image_filename != '') \
+            .order_by(Product.id).all()
+        for product in products:
+            rendition = os.path.join(app.config['UPLOAD_FOLDER'],
+                                     rendition_filename(product.image_filename, 'card', 'webp'))
+            if not force and os.path.exists(rendition):
+                continue
+
+            source = find_original(product.image_filename)
+            if source is None:
+                print(f"⚠️  {product.product_code}: original '{product.image_filename}' not found")
+                missing += 1
+                continue
+
+            with open(source, 'rb') as f:
+                data = f.read()
+            ext = product.image_filename.rsplit('.', 1)[1] if '.' in product.image_filename else 'jpg'
+            image_filename = store_product_image(data, ext)
+            if image_filename is None:
+                print(f"❌ {product.product_code}: could not process '{product.image_filename}'")
+                failed += 1
+                continue
+
+            product.image_filename = image_filename
+            processed += 1
+            if processed % 100 == 0:
+                db.session.commit()
+                print(f"   ... {processed} products processed")
+
+        db.session.commit()
+        print(f"\n✅ Processed {processed} products ({missing} missing originals, {failed} failed)\n")
+        return failed == 0
+
+
+if __name__ == '__main__':
+    import sys
+    success = backfill_product_images(force='--force' in sys.argv)
+    if not success:
+        exit(1)
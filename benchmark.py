@@ -0,0 +1,375 @@
+"""Benchmark the storefront hot paths and write the results as JSON.
+
+Boots app.py in-process against SQLite (default) or a local MySQL database,
+seeds a catalog and order history, then drives each scenario through the
+Flask test client from several threads and reports latency percentiles and
+throughput. The queries behind the paged views are EXPLAINed first, and any
+that sort outside an index are flagged as a filesort in 'query_plans'.
+
+    python benchmark.py --products 2000 --orders 5000 --output results.json
+    python benchmark.py --database-url mysql+pymysql://root:pw@localhost/shop_bench
+    python benchmark.py --compare results.json      # exit 1 on a p95 regression
+
+Only 2xx/3xx responses are timed; the run exits 1 if any scenario's error
+rate exceeds --max-error-rate, since fast error pages would flatter the numbers.
+
+Use a dedicated database: the seed step creates tables and adds rows to it.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+SCENARIOS = ['shop', 'product_detail', 'cart_add', 'cart', 'checkout', 'orders', 'dashboard', 'admin_orders',
+             'export']
+BENCH_PASSWORD = 'bench-password'
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the storefront hot paths.')
+    parser.add_argument('--database-url', help='SQLAlchemy URL; defaults to a fresh SQLite file')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--orders', type=int, default=2000, help='orders in the seeded history')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset to run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-seed', action='store_true', help='reuse data from a previous run')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.20, help='allowed p95 slowdown vs the baseline')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='fail when more than this fraction of a scenario\'s requests return 4xx/5xx')
+    return parser.parse_args(argv)
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+def insert_chunks(shop, model, rows, chunk_size=1000):
+    for start in range(0, len(rows), chunk_size):
+        shop.db.session.execute(shop.db.insert(model), rows[start:start + chunk_size])
+
+
+def seed(shop, args, rng):
+    """Catalog, one bench user per client thread, an admin and an order history."""
+    db = shop.db
+    db.create_all()
+    password_hash = shop.generate_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+
+    insert_chunks(shop, shop.User, [
+        {'username': 'bench_admin', 'email': 'bench_admin@example.com', 'password_hash': password_hash,
+         'role': 'Admin', 'is_active': True, 'created_at': now}
+    ] + [
+        {'username': f'bench_{i}', 'email': f'bench_{i}@example.com', 'password_hash': password_hash,
+         'role': 'User', 'is_active': True, 'created_at': now}
+        for i in range(args.concurrency)
+    ])
+    insert_chunks(shop, shop.Category, [{'name': f'Bench Category {i}', 'is_deleted': False, 'created_at': now}
+                                        for i in range(args.categories)])
+    db.session.flush()
+    category_ids = db.session.execute(db.select(shop.Category.id)).scalars().all()
+    user_ids = db.session.execute(db.select(shop.User.id).where(shop.User.username.like('bench\\_%', escape='\\'),
+                                                                shop.User.role == 'User')).scalars().all()
+
+    insert_chunks(shop, shop.Product, [
+        {'product_code': f'BN{i:07d}', 'name': f'Bench Tee {i}', 'color': rng.choice(['Black', 'White', 'Red', 'Navy']),
+         'price': round(rng.uniform(199, 2499), 2), 'category_id': rng.choice(category_ids), 'is_deleted': False,
+         'created_at': now - timedelta(minutes=i), 'updated_at': now}
+        for i in range(args.products)
+    ])
+    db.session.flush()
+    product_ids = db.session.execute(db.select(shop.Product.id).where(shop.Product.product_code.like('BN%'))) \
+        .scalars().all()
+    # Deep stock so repeated checkouts never run out mid-benchmark
+    insert_chunks(shop, shop.ProductSize, [{'product_id': product_id, 'size': size, 'quantity': 1000000}
+                                           for product_id in product_ids for size in SIZES[1:5]])
+
+    insert_chunks(shop, shop.Customer, [
+        {'first_name': 'Bench', 'last_name': str(user_id), 'email': f'customer_{user_id}@example.com',
+         'phone': '09170000000', 'address': 'Bench Street', 'user_id': user_id, 'is_deleted': False,
+         'created_at': now}
+        for user_id in user_ids
+    ])
+    db.session.flush()
+    customer_ids = db.session.execute(db.select(shop.Customer.id).where(shop.Customer.user_id.in_(user_ids))) \
+        .scalars().all()
+
+    statuses = ['Pending', 'Processing', 'Completed', 'Cancelled']
+    insert_chunks(shop, shop.Order, [
+        {'customer_id': customer_ids[i % len(customer_ids)], 'order_date': now - timedelta(hours=i),
+         'total_amount': 0, 'status': rng.choice(statuses), 'payment_status': 'Paid', 'is_deleted': False}
+        for i in range(args.orders)
+    ])
+    db.session.flush()
+    order_ids = db.session.execute(db.select(shop.Order.id).where(shop.Order.customer_id.in_(customer_ids))) \
+        .scalars().all()
+    insert_chunks(shop, shop.OrderDetail, [
+        {'order_id': order_id, 'product_id': rng.choice(product_ids), 'size': rng.choice(SIZES[1:5]),
+         'quantity': rng.randint(1, 3), 'price': 499.0}
+        for order_id in order_ids for _ in range(rng.randint(1, 4))
+    ])
+    db.session.commit()
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+class BenchClient:
+    """A logged-in test client plus what the scenarios need to know about the catalog."""
+
+    def __init__(self, shop, username, product_ids):
+        self.client = shop.app.test_client()
+        self.username = username
+        self.product_ids = product_ids
+        self.rng = random.Random(username)
+        response = self.client.post('/login', data={'username': username, 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f"Could not log in as {username} (HTTP {response.status_code})")
+
+    def product_id(self):
+        return self.rng.choice(self.product_ids)
+
+    def add_to_cart(self):
+        return self.client.post(f'/cart/add/{self.product_id()}', data={'size': 'M', 'quantity': '1'})
+
+
+def checkout(bench):
+    return bench.client.post('/checkout', data={
+        'first_name': 'Bench', 'last_name': 'User', 'email': f'{bench.username}@example.com', 'phone': '09170000000',
+        'address': 'Bench Street', 'idempotency_key': f'{threading.get_ident()}-{time.perf_counter_ns()}'})
+
+
+# name -> (account, untimed preparation or None, timed request)
+SCENARIO_REQUESTS = {
+    'shop': ('user', None, lambda bench: bench.client.get('/shop')),
+    'product_detail': ('user', None, lambda bench: bench.client.get(f'/shop/product/{bench.product_id()}')),
+    'cart_add': ('user', None, BenchClient.add_to_cart),
+    # Carts already hold the lines added by the cart_add scenario
+    'cart': ('user', None, lambda bench: bench.client.get('/cart')),
+    'checkout': ('user', BenchClient.add_to_cart, checkout),
+    'orders': ('user', None, lambda bench: bench.client.get('/orders')),
+    'dashboard': ('admin', None, lambda bench: bench.client.get('/dashboard')),
+    'admin_orders': ('admin', None, lambda bench: bench.client.get('/admin/orders')),
+    'export': ('admin', None, lambda bench: bench.client.get('/products/export')),
+}
+
+
+def run_scenario(shop, name, args, product_ids):
+    account, prepare, send = SCENARIO_REQUESTS[name]
+    usernames = ['bench_admin'] * args.concurrency if account == 'admin' else \
+        [f'bench_{i}' for i in range(args.concurrency)]
+    clients = [BenchClient(shop, username, product_ids) for username in usernames]
+    for i in range(args.warmup):
+        if prepare:
+            prepare(clients[i % len(clients)])
+        send(clients[i % len(clients)])
+
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    per_thread = [args.requests // args.concurrency + (1 if i < args.requests % args.concurrency else 0)
+                  for i in range(args.concurrency)]
+
+    def worker(bench, count):
+        for _ in range(count):
+            if prepare:
+                prepare(bench)
+            started = time.perf_counter()
+            response = send(bench)
+            response.get_data()  # drain streamed bodies such as the CSV export
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if response.status_code < 400:
+                    latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(bench, count)) for bench, count in zip(clients, per_thread)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    total = sum(statuses.values())
+    errors = total - len(latencies)
+    percentile = shop.percentile
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else None,
+        'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        # Successful responses only
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': round(percentile(latencies, 50), 3) if latencies else None,
+            'p90': round(percentile(latencies, 90), 3) if latencies else None,
+            'p95': round(percentile(latencies, 95), 3) if latencies else None,
+            'p99': round(percentile(latencies, 99), 3) if latencies else None,
+            'max': round(latencies[-1], 3) if latencies else None,
+        },
+    }
+
+
+# ---------------------------------------------------------------------------
+# Query plans
+# ---------------------------------------------------------------------------
+
+def hot_queries(shop):
+    """First pages of the paged views, built the way the routes build them."""
+    Order, Product, db = shop.Order, shop.Product, shop.db
+    customer_id = db.session.execute(db.select(shop.Customer.id).order_by(shop.Customer.id).limit(1)).scalar()
+    category_id = db.session.execute(db.select(shop.Category.id).order_by(shop.Category.id).limit(1)).scalar()
+    newest_first = (Order.order_date.desc(), Order.id.desc())
+    return {
+        'orders': Order.query.filter_by(customer_id=customer_id, is_deleted=False).order_by(*newest_first).limit(21),
+        'admin_orders': Order.query.filter(Order.is_deleted == False).order_by(*newest_first).limit(26),
+        'admin_orders_status': Order.query.filter(Order.is_deleted == False, Order.status == 'Pending')
+        .order_by(*newest_first).limit(26),
+        'admin_status_counts': Order.query.filter(Order.is_deleted == False)
+        .with_entities(Order.status, db.func.count(Order.id)).group_by(Order.status),
+        'shop': Product.query.filter_by(is_deleted=False).order_by(Product.name, Product.id).limit(13),
+        'shop_category': Product.query.filter_by(is_deleted=False, category_id=category_id)
+        .order_by(Product.name, Product.id).limit(13),
+        'shop_count': Product.query.filter_by(is_deleted=False).with_entities(db.func.count()),
+        'dashboard_recent': Product.query.filter_by(is_deleted=False).order_by(Product.created_at.desc()).limit(5),
+    }
+
+
+def explain_hot_queries(shop):
+    """EXPLAIN each hot query; a plan with 'filesort' true sorts rows outside an index."""
+    plans = {}
+    connection = shop.db.session.connection()
+    dialect = connection.dialect
+    for name, query in hot_queries(shop).items():
+        statement = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+        plan = shop.explain_statement(connection.connection.dbapi_connection, dialect.name, statement, ())
+        plans[name] = dict(shop.plan_summary(plan), plan=plan)
+    return plans
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not previous['latency_ms']['p95'] or not current['latency_ms']['p95']:
+            continue
+        ratio = current['latency_ms']['p95'] / previous['latency_ms']['p95']
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: p95 {previous['latency_ms']['p95']}ms -> "
+                               f"{current['latency_ms']['p95']}ms (+{(ratio - 1) * 100:.0f}%)")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    for name, plan in results.get('query_plans', {}).items():
+        if plan['filesort'] and baseline.get('query_plans', {}).get(name, {}).get('filesort') is False:
+            regressions.append(f"{name}: query plan now sorts outside an index (filesort)")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIO_REQUESTS]
+    if unknown:
+        sys.exit(f"Unknown scenario(s): {', '.join(unknown)}. Choose from {', '.join(SCENARIOS)}")
+
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='shop-bench-'), 'bench.db')}"
+    # Must be set before app.py is imported, which reads it at module level
+    os.environ['DATABASE_URL'] = args.database_url
+    import app as shop
+
+    rng = random.Random(args.seed)
+    with shop.app.app_context():
+        if not args.no_seed:
+            print(f"🌱 Seeding {args.products} products and {args.orders} orders...", file=sys.stderr)
+            seed(shop, args, rng)
+        product_ids = shop.db.session.execute(
+            shop.db.select(shop.Product.id).where(shop.Product.is_deleted == False)).scalars().all()
+        dialect = shop.db.engine.dialect.name
+        query_plans = explain_hot_queries(shop)
+    if not product_ids:
+        sys.exit("No products to benchmark; run without --no-seed first")
+
+    results = {
+        'started_at': datetime.utcnow().isoformat() + 'Z',
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'database': dialect,
+        'config': {'products': args.products, 'orders': args.orders, 'requests': args.requests,
+                   'warmup': args.warmup, 'concurrency': args.concurrency, 'seed': args.seed},
+        'query_plans': query_plans,
+        'scenarios': {},
+    }
+    for name, plan in query_plans.items():
+        if plan['filesort']:
+            print(f"⚠️  {name}: sorts outside an index (filesort)", file=sys.stderr)
+        else:
+            print(f"🗂️  {name}: {', '.join(plan['indexes']) or 'no index'}"
+                  f"{' (covering)' if plan['covering'] else ''}", file=sys.stderr)
+    for name in scenarios:
+        print(f"⏱️  {name}...", file=sys.stderr)
+        results['scenarios'][name] = run_scenario(shop, name, args, product_ids)
+        summary = results['scenarios'][name]
+        print(f"   p50 {summary['latency_ms']['p50']}ms  p95 {summary['latency_ms']['p95']}ms  "
+              f"{summary['throughput_rps']} req/s  {summary['errors']} errors", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"✅ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    failing = [name for name, summary in results['scenarios'].items()
+               if summary['error_rate'] and summary['error_rate'] > args.max_error_rate]
+    if failing:
+        print(f"❌ Error rate above {args.max_error_rate:.1%}:", file=sys.stderr)
+        for name in failing:
+            summary = results['scenarios'][name]
+            print(f"   • {name}: {summary['errors']}/{summary['requests']} failed ({summary['status_codes']})",
+                  file=sys.stderr)
+        return 1
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        if regressions:
+            print("❌ Regressions against baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"   • {regression}", file=sys.stderr)
+            return 1
+        print("✅ No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
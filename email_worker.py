@@ -0,0 +1,48 @@
+import argparse
+import time
+
+from app import app, db, SMTPSender, deliver_outbox_batch, purge_outbox
+
+PURGE_INTERVAL_SECONDS = 3600
+
+
+def run_worker(poll_interval=2.0, batch_size=50, once=False):
+    sender = SMTPSender.from_env()
+    print(f"📬 Email worker started (SMTP {sender.host}:{sender.port}, batch size {batch_size})")
+    purged_at = 0.0
+    try:
+        while True:
+            with app.app_context():
+                try:
+                    if time.monotonic() - purged_at >= PURGE_INTERVAL_SECONDS:
+                        purged = purge_outbox()
+                        purged_at = time.monotonic()
+                        if purged:
+                            print(f"🧹 Purged {purged} old email(s)")
+                    sent = deliver_outbox_batch(sender, batch_size=batch_size)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Email worker error: {e}")
+                    sent = 0
+                finally:
+                    db.session.remove()
+            if sent:
+                print(f"✉️  Processed {sent} email(s)")
+            if once:
+                break
+            # Keep draining while there is a backlog, otherwise poll
+            if sent < batch_size:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("\n👋 Email worker stopped")
+    finally:
+        sender.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deliver queued emails from the email_outbox table.')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='seconds to wait when the outbox is empty')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--once', action='store_true', help='process a single batch and exit')
+    args = parser.parse_args()
+    run_worker(poll_interval=args.poll_interval, batch_size=args.batch_size, once=args.once)
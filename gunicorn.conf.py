@@ -0,0 +1,29 @@
+"""gunicorn settings: gunicorn -c gunicorn.conf.py app:app
+
+Sets up prometheus_client multiprocess mode so /metrics reports the totals of
+all workers rather than whichever worker happens to answer the scrape.
+"""
+import os
+import shutil
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+
+# Must be set before the workers import prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'shop-metrics'))
+
+
+def on_starting(server):
+    # Samples left over from a previous run would be added to the new totals
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,217 @@
+"""Local stand-in for the PayMongo checkout API, for development and load tests.
+
+Implements the calls PayMongoClient makes (create and retrieve checkout
+sessions) plus a hosted checkout page that "pays" by redirecting back to the
+shop. Point the app at it with PAYMONGO_API_BASE=http://127.0.0.1:8025/v1 and
+any PAYMONGO_SECRET_KEY (e.g. sk_test_local). With --webhook-url it also
+delivers signed checkout_session.payment.paid events, like the real gateway.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+
+class _PayMongoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, detail):
+        self.send_json(status, {'errors': [{'code': 'error', 'detail': detail}]})
+
+    def redirect(self, location):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def simulate_conditions(self):
+        """Apply the configured latency and random failures; returns False if the request failed."""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.failure_rate and random.random() < self.server.failure_rate:
+            self.send_error_json(503, 'Simulated gateway outage')
+            return False
+        return True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if urlsplit(self.path).path != '/v1/checkout_sessions':
+            return self.send_error_json(404, 'Not found')
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            return self.send_error_json(401, 'API key is missing')
+        if not self.simulate_conditions():
+            return
+        try:
+            attributes = json.loads(body)['data']['attributes']
+        except (ValueError, KeyError, TypeError):
+            return self.send_error_json(400, 'Invalid request body')
+        self.send_json(200, {'data': self.server.create_session(attributes, self.headers.get('Idempotency-Key'))})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) == 3 and parts[:2] == ['v1', 'checkout_sessions']:
+            if not self.simulate_conditions():
+                return
+            checkout_session = self.server.sessions.get(parts[2])
+            if checkout_session is None:
+                return self.send_error_json(404, 'Checkout session not found')
+            return self.send_json(200, {'data': checkout_session})
+
+        if len(parts) == 2 and parts[0] == 'checkout':
+            checkout_session = self.server.sessions.get(parts[1])
+            if checkout_session is None:
+                return self.send_error_json(404, 'Checkout session not found')
+            action = parse_qs(url.query).get('action', ['pay' if self.server.auto_pay else ''])[0]
+            if action in ('pay', 'cancel'):
+                return self.redirect(self.server.complete_session(checkout_session, paid=action == 'pay'))
+            return self.send_checkout_page(checkout_session)
+
+        self.send_error_json(404, 'Not found')
+
+    def send_checkout_page(self, checkout_session):
+        attributes = checkout_session['attributes']
+        amount = sum(item['amount'] * item['quantity'] for item in attributes['line_items']) / 100
+        data = (f"<html><body><h1>Local PayMongo</h1><p>Pay &#8369;{amount:,.2f} via "
+                f"{', '.join(attributes['payment_method_types'])}</p>"
+                f"<a href='?action=pay'>Authorize payment</a> | <a href='?action=cancel'>Cancel</a>"
+                f"</body></html>").encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class LocalPayMongoServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=8025, latency=0.0, failure_rate=0.0, auto_pay=False,
+                 webhook_url=None, webhook_secret=None, verbose=False):
+        super().__init__((host, port), _PayMongoHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.auto_pay = auto_pay
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.webhooks_sent = []
+        self.verbose = verbose
+        self.sessions = {}
+        self._idempotency_keys = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.port}"
+
+    def create_session(self, attributes, idempotency_key=None):
+        with self._lock:
+            if idempotency_key in self._idempotency_keys:
+                return self.sessions[self._idempotency_keys[idempotency_key]]
+            session_id = f"cs_{uuid.uuid4().hex[:24]}"
+            checkout_session = {
+                'id': session_id,
+                'type': 'checkout_session',
+                'attributes': dict(attributes, status='active', payments=[],
+                                   checkout_url=f"{self.base_url}/checkout/{session_id}",
+                                   created_at=int(time.time())),
+            }
+            self.sessions[session_id] = checkout_session
+            if idempotency_key:
+                self._idempotency_keys[idempotency_key] = session_id
+        return checkout_session
+
+    def complete_session(self, checkout_session, paid):
+        """Mark the session paid or cancelled and return where the browser goes next."""
+        attributes = checkout_session['attributes']
+        with self._lock:
+            newly_paid = attributes['status'] == 'active' and paid
+            if attributes['status'] == 'active':
+                attributes['status'] = 'paid' if paid else 'cancelled'
+                if paid:
+                    attributes['payments'].append({'id': f"pay_{uuid.uuid4().hex[:24]}", 'type': 'payment',
+                                                   'attributes': {'status': 'paid', 'paid_at': int(time.time())}})
+        if newly_paid and self.webhook_url:
+            threading.Thread(target=self.send_webhook, args=('checkout_session.payment.paid', checkout_session),
+                             daemon=True).start()
+        if self.verbose:
+            print(f"💳 {checkout_session['id']} (order {attributes.get('reference_number')}): {attributes['status']}")
+        return attributes['success_url'] if attributes['status'] == 'paid' else attributes['cancel_url']
+
+    def sign(self, body, timestamp=None):
+        timestamp = int(timestamp or time.time())
+        signature = hmac.new((self.webhook_secret or '').encode('utf-8'), f"{timestamp}.".encode('utf-8') + body,
+                             hashlib.sha256).hexdigest()
+        return f"t={timestamp},te={signature},li="
+
+    def send_webhook(self, event_type, resource):
+        body = json.dumps({'data': {'id': f"evt_{uuid.uuid4().hex[:24]}", 'type': 'event',
+                                    'attributes': {'type': event_type, 'livemode': False, 'data': resource,
+                                                   'created_at': int(time.time())}}}).encode('utf-8')
+        try:
+            response = requests.post(self.webhook_url, data=body, timeout=5,
+                                     headers={'Content-Type': 'application/json',
+                                              'Paymongo-Signature': self.sign(body)})
+            status = response.status_code
+        except requests.RequestException as e:
+            status = str(e)
+        with self._lock:
+            self.webhooks_sent.append((event_type, resource['id'], status))
+        if self.verbose:
+            print(f"📨 {event_type} for {resource['id']} -> {status}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the PayMongo checkout API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API call')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of API calls answered with 503')
+    parser.add_argument('--auto-pay', action='store_true', help='pay immediately when the checkout page is opened')
+    parser.add_argument('--webhook-url', help='e.g. http://127.0.0.1:5000/webhooks/payments')
+    parser.add_argument('--webhook-secret', default='whsk_local', help='must match PAYMONGO_WEBHOOK_SECRET')
+    args = parser.parse_args()
+    server = LocalPayMongoServer(args.host, args.port, latency=args.latency, failure_rate=args.failure_rate,
+                                 auto_pay=args.auto_pay, webhook_url=args.webhook_url,
+                                 webhook_secret=args.webhook_secret, verbose=True)
+    print(f"💳 Local PayMongo listening on {server.base_url}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
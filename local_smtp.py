@@ -0,0 +1,116 @@
+"""Minimal in-process SMTP server for development and tests.
+
+Accepts any AUTH credentials and keeps every received message in memory.
+Point the app at it with MAIL_SERVER=localhost, MAIL_PORT=1025 and
+MAIL_USE_TLS=False.
+"""
+import argparse
+import socketserver
+import threading
+from email import message_from_bytes
+from email import policy
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        self.reply('220 localhost LocalSMTP ready')
+        mail_from, rcpt_to = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            command = line.split(' ', 1)[0].upper()
+
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250-AUTH PLAIN LOGIN')
+                self.reply('250 SIZE 16777216')
+            elif command == 'HELO':
+                self.reply('250 localhost')
+            elif command == 'AUTH':
+                parts = line.split()
+                mechanism = parts[1].upper() if len(parts) > 1 else ''
+                if mechanism == 'LOGIN':
+                    if len(parts) < 3:
+                        self.reply('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                    self.reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                elif len(parts) < 3:
+                    self.reply('334 ')
+                    self.rfile.readline()
+                self.reply('235 Authentication successful')
+            elif command == 'MAIL':
+                mail_from, rcpt_to = line.split(':', 1)[1].strip(), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                rcpt_to.append(line.split(':', 1)[1].strip())
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                chunks = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b'.\r\n', b'.\n'):
+                        break
+                    chunks.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                self.server.store(mail_from, rcpt_to, b''.join(chunks))
+                mail_from, rcpt_to = None, []
+                self.reply('250 OK queued')
+            elif command in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=1025, verbose=False):
+        super().__init__((host, port), _SMTPHandler)
+        self.verbose = verbose
+        self.messages = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def store(self, mail_from, rcpt_to, data):
+        message = message_from_bytes(data, policy=policy.default)
+        with self._lock:
+            self.messages.append({'from': mail_from, 'to': rcpt_to, 'message': message})
+        if self.verbose:
+            print(f"✉️  {mail_from} -> {', '.join(rcpt_to)}: {message['Subject']}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local SMTP sink that prints received emails.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+    server = LocalSMTPServer(args.host, args.port, verbose=True)
+    print(f"📭 Local SMTP server listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
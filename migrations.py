@@ -0,0 +1,442 @@
+"""Versioned schema migrations, applied by migrate_database.py.
+
+Each Migration is a numbered list of operations. The runner groups the column
+and index changes of a migration by table and issues one ALTER TABLE per
+table, so a table is rebuilt at most once however many columns it gains. On
+MySQL every ALTER is tried with ALGORITHM=INSTANT, then ALGORITHM=INPLACE,
+LOCK=NONE, and only then with the server's default (table copy). Applied
+versions, with the duration of each statement, are recorded in
+schema_version.
+
+Operations check the live schema first and skip what is already there, so a
+database brought up to date by create_all() or by the old migration script
+is simply recorded as migrated. For the same reason a migration that fails
+half way can be re-run once the cause is fixed.
+
+Add a migration by appending to MIGRATIONS with the next version number;
+never edit one that has been released.
+"""
+import json
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from app import Cart, OutboxEmail, PaymentEvent, ProductSize, SchemaVersion
+
+# MySQL error codes for "this ALGORITHM/LOCK is not supported for the ALTER"
+ALTER_NOT_SUPPORTED = {1845, 1846}
+ONLINE_ALGORITHMS = [('INSTANT', None), ('INPLACE', 'NONE'), (None, None)]
+MIGRATION_LOCK = 'shop_schema_migrations'
+MIGRATION_LOCK_TIMEOUT = 60
+
+
+# ---------------------------------------------------------------------------
+# Operations
+# ---------------------------------------------------------------------------
+
+@dataclass
+class AddColumn:
+    table: str
+    column: str
+    definition: str
+    after: str = None
+
+    def clause(self, schema, dialect):
+        if self.column in schema.columns:
+            return None
+        clause = f"ADD COLUMN {self.column} {self.definition}"
+        # AFTER only keeps SHOW COLUMNS tidy; skip it when the anchor column is missing
+        if dialect == 'mysql' and self.after and self.after in schema.columns:
+            clause += f" AFTER {self.after}"
+        return clause
+
+
+@dataclass
+class ModifyColumn:
+    """Change a column's definition, but only while its type is one of `from_types` (e.g. 'enum')."""
+    table: str
+    column: str
+    definition: str
+    from_types: tuple = ()
+
+    def clause(self, schema, dialect):
+        current = schema.columns.get(self.column)
+        if current is None or dialect != 'mysql':
+            return None
+        if self.from_types and type(current['type']).__name__.lower() not in self.from_types:
+            return None
+        return f"MODIFY COLUMN {self.column} {self.definition}"
+
+
+@dataclass
+class AddIndex:
+    table: str
+    name: str
+    columns: tuple
+    unique: bool = False
+    # MySQL only; skipped elsewhere, where search falls back to LIKE
+    fulltext: bool = False
+
+    def clause(self, schema, dialect):
+        if self.fulltext and dialect != 'mysql':
+            return None
+        # An index on the same columns under another name (create_all, Database script) counts
+        if self.name in schema.indexes or (tuple(self.columns), self.unique) in schema.indexes.values():
+            return None
+        kind = 'FULLTEXT ' if self.fulltext else 'UNIQUE ' if self.unique else ''
+        return f"ADD {kind}INDEX {self.name} ({', '.join(self.columns)})"
+
+
+@dataclass
+class DropIndex:
+    table: str
+    name: str
+
+    def clause(self, schema, dialect):
+        return f"DROP INDEX {self.name}" if self.name in schema.indexes else None
+
+
+@dataclass
+class CreateTable:
+    model: type
+
+    def run(self, connection):
+        if inspect(connection).has_table(self.model.__tablename__):
+            return []
+        self.model.__table__.create(connection)
+        return [self.describe()]
+
+    def describe(self):
+        return f"CREATE TABLE {self.model.__tablename__}"
+
+
+@dataclass
+class RunPython:
+    """Data migration: `function(connection)` returns a short description of what it did, or None."""
+    function: object
+
+    def run(self, connection):
+        done = self.function(connection)
+        return [done] if done else []
+
+    def describe(self):
+        return f"run {self.function.__name__}"
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    operations: list = field(default_factory=list)
+
+
+@dataclass
+class TableSchema:
+    columns: dict
+    # name -> (columns, unique)
+    indexes: dict
+
+    @classmethod
+    def load(cls, connection, table):
+        inspector = inspect(connection)
+        if not inspector.has_table(table):
+            return None
+        indexes = {index['name']: (tuple(index['column_names']), bool(index.get('unique')))
+                   for index in inspector.get_indexes(table)}
+        for constraint in inspector.get_unique_constraints(table):
+            indexes.setdefault(constraint['name'], (tuple(constraint['column_names']), True))
+        return cls({column['name']: column for column in inspector.get_columns(table)}, indexes)
+
+
+# ---------------------------------------------------------------------------
+# Data migrations
+# ---------------------------------------------------------------------------
+
+def copy_size_quantities(connection):
+    """Move the retired products.size_quantities JSON into product_size rows."""
+    if 'size_quantities' not in TableSchema.load(connection, 'products').columns:
+        return None
+    stocked = {row[0] for row in connection.execute(text("SELECT DISTINCT product_id FROM product_size"))}
+    quantities = {}
+    for product_id, size_quantities in connection.execute(
+            text("SELECT id, size_quantities FROM products WHERE size_quantities IS NOT NULL")):
+        if product_id in stocked:
+            continue
+        if isinstance(size_quantities, str):
+            size_quantities = json.loads(size_quantities)
+        for size, quantity in (size_quantities or {}).items():
+            # create_product used to store keys as 'shirt_M' / 'pant_32'
+            size = size.split('_', 1)[1] if size.startswith(('shirt_', 'pant_')) else size
+            # ...and later edits added plain 'M' / '32' keys beside them; both count
+            quantities[product_id, size] = quantities.get((product_id, size), 0) + max(int(quantity), 0)
+    levels = [{'product_id': product_id, 'size': size, 'quantity': quantity}
+              for (product_id, size), quantity in quantities.items()]
+    if levels:
+        connection.execute(ProductSize.__table__.insert(), levels)
+    # New products no longer set the column, so it cannot stay NOT NULL
+    if connection.dialect.name == 'mysql':
+        connection.execute(text("ALTER TABLE products MODIFY COLUMN size_quantities JSON NULL"))
+    elif connection.dialect.name == 'sqlite':
+        # SQLite cannot relax a constraint in place; the data now lives in product_size
+        connection.execute(text("ALTER TABLE products DROP COLUMN size_quantities"))
+    return f"copied {len(levels)} size rows into product_size"
+
+
+# ---------------------------------------------------------------------------
+# Migrations
+# ---------------------------------------------------------------------------
+
+MIGRATIONS = [
+    Migration(1, 'Product image filenames', [
+        AddColumn('products', 'image_filename', 'VARCHAR(255) NULL'),
+    ]),
+    Migration(2, 'Order payment columns', [
+        AddColumn('orders', 'payment_method', 'VARCHAR(50) NULL', after='status'),
+        AddColumn('orders', 'payment_status', "VARCHAR(20) NOT NULL DEFAULT 'Unpaid'", after='payment_method'),
+        AddColumn('orders', 'payment_reference', 'VARCHAR(255) NULL', after='payment_status'),
+        AddIndex('orders', 'ix_orders_payment_status', ('payment_status',)),
+        AddIndex('orders', 'ix_orders_payment_reference', ('payment_reference',)),
+        AddIndex('orders', 'ix_orders_order_date', ('order_date',)),
+    ]),
+    Migration(3, 'Role and order status as VARCHAR', [
+        # The original ENUMs have no 'User' role and no 'Expired' status
+        ModifyColumn('users', 'role', "VARCHAR(20) NOT NULL DEFAULT 'User'", from_types=('enum',)),
+        ModifyColumn('orders', 'status', "VARCHAR(20) NOT NULL DEFAULT 'Pending'", from_types=('enum',)),
+    ]),
+    Migration(4, 'Per-size stock table', [
+        CreateTable(ProductSize),
+        RunPython(copy_size_quantities),
+    ]),
+    Migration(5, 'Server-side carts and email outbox', [
+        CreateTable(Cart),
+        CreateTable(OutboxEmail),
+    ]),
+    Migration(6, 'Stock reservations and checkout idempotency keys', [
+        AddColumn('orders', 'reserved_until', 'DATETIME NULL', after='payment_reference'),
+        AddColumn('orders', 'idempotency_key', 'VARCHAR(64) NULL', after='reserved_until'),
+        AddIndex('orders', 'ix_orders_reserved_until', ('reserved_until',)),
+        AddIndex('orders', 'uq_orders_idempotency_key', ('idempotency_key',), unique=True),
+    ]),
+    Migration(7, 'Payment webhook queue', [
+        CreateTable(PaymentEvent),
+    ]),
+    Migration(8, 'Composite indexes for order history, admin orders and product browsing', [
+        AddIndex('orders', 'ix_orders_customer_history', ('customer_id', 'is_deleted', 'order_date')),
+        AddIndex('orders', 'ix_orders_deleted_date', ('is_deleted', 'order_date')),
+        AddIndex('orders', 'ix_orders_deleted_status_date', ('is_deleted', 'status', 'order_date')),
+        # Prefixes of the composites; the foreign key on customer_id now uses ix_orders_customer_history
+        DropIndex('orders', 'ix_orders_is_deleted'),
+        DropIndex('orders', 'idx_is_deleted'),
+        DropIndex('orders', 'idx_customer_id'),
+        AddIndex('products', 'ix_products_browse', ('is_deleted', 'name')),
+        AddIndex('products', 'ix_products_category_browse', ('is_deleted', 'category_id', 'name')),
+        AddIndex('products', 'ix_products_recent', ('is_deleted', 'created_at')),
+        DropIndex('products', 'ix_products_is_deleted'),
+        DropIndex('products', 'idx_is_deleted'),
+    ]),
+    Migration(9, 'Email outbox claims', [
+        AddColumn('email_outbox', 'claimed_at', 'DATETIME NULL', after='created_at'),
+    ]),
+    Migration(10, 'Full-text product search index', [
+        # For SEARCH_BACKEND=fulltext; the Database script creates it for new installs
+        AddIndex('products', 'ft_products_search', ('product_code', 'name', 'color'), fulltext=True),
+    ]),
+]
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+class MigrationError(Exception):
+    pass
+
+
+class MigrationRunner:
+    def __init__(self, engine, migrations=MIGRATIONS, log=print):
+        self.engine = engine
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.log = log
+        versions = [migration.version for migration in self.migrations]
+        if len(set(versions)) != len(versions):
+            raise MigrationError(f"Duplicate migration versions in {versions}")
+
+    def applied(self, connection, create=False):
+        """{version: row} of applied migrations; reports never create schema_version."""
+        if not inspect(connection).has_table(SchemaVersion.__tablename__):
+            if not create:
+                return {}
+            SchemaVersion.__table__.create(connection)
+            connection.commit()
+        return {row.version: row for row in connection.execute(SchemaVersion.__table__.select())}
+
+    def pending(self, connection, target=None, create=False):
+        applied = self.applied(connection, create=create)
+        return [migration for migration in self.migrations
+                if migration.version not in applied and (target is None or migration.version <= target)]
+
+    def plan(self, connection, migration, planned=None):
+        """What `migration` would run now: [(kind, table or None, payload)] in execution order.
+
+        A dry run passes the same `planned` ({'tables': set(), 'changes': {}}) for
+        every pending migration; it records the tables, columns and indexes
+        earlier steps would have created, so later migrations are planned against
+        that schema rather than the unchanged database.
+        """
+        dialect = connection.dialect.name
+        creates = [op for op in migration.operations if isinstance(op, CreateTable)]
+        steps = [('create', None, op) for op in creates]
+        created = planned['tables'] if planned is not None else set()
+        created.update(op.model.__tablename__ for op in creates
+                       if not inspect(connection).has_table(op.model.__tablename__))
+        by_table = {}
+        for op in migration.operations:
+            if isinstance(op, (AddColumn, ModifyColumn, AddIndex, DropIndex)):
+                by_table.setdefault(op.table, []).append(op)
+        for table, ops in by_table.items():
+            if table in created:
+                # CreateTable builds the current model, which already has these columns and indexes
+                continue
+            schema = TableSchema.load(connection, table)
+            if schema is None:
+                raise MigrationError(f"Table '{table}' does not exist; run create_db.py first")
+            changes = None
+            if planned is not None:
+                changes = planned['changes'].setdefault(table, {'columns': {}, 'indexes': {}, 'dropped': set()})
+                schema = self.overlay(schema, changes)
+            # New indexes go first so a foreign key never loses its only index mid-ALTER
+            ops = [op for op in ops if not isinstance(op, DropIndex)] + [op for op in ops if isinstance(op, DropIndex)]
+            clauses = []
+            for op in ops:
+                clause = op.clause(schema, dialect)
+                if not clause:
+                    continue
+                clauses.append(clause)
+                if changes is not None:
+                    self.record(changes, op)
+            if clauses:
+                steps.append(('alter', table, clauses))
+        steps += [('python', None, op) for op in migration.operations if isinstance(op, RunPython)]
+        return steps
+
+    @staticmethod
+    def overlay(schema, changes):
+        """`schema` as it would be after the changes recorded by earlier planned steps."""
+        indexes = {name: index for name, index in schema.indexes.items() if name not in changes['dropped']}
+        indexes.update(changes['indexes'])
+        return TableSchema({**schema.columns, **changes['columns']}, indexes)
+
+    @staticmethod
+    def record(changes, op):
+        if isinstance(op, AddColumn):
+            # No reflected type: ModifyColumn(from_types=...) leaves a freshly added column alone
+            changes['columns'][op.column] = {'name': op.column, 'type': None}
+        elif isinstance(op, AddIndex):
+            changes['indexes'][op.name] = (tuple(op.columns), op.unique)
+            changes['dropped'].discard(op.name)
+        elif isinstance(op, DropIndex):
+            changes['indexes'].pop(op.name, None)
+            changes['dropped'].add(op.name)
+
+    def alter(self, connection, table, clauses):
+        """Run one ALTER TABLE with the most online algorithm the server accepts; returns the step record."""
+        if connection.dialect.name != 'mysql':
+            return [self.timed(connection, statement, None) for statement in self.portable_statements(table, clauses)]
+
+        statement = f"ALTER TABLE {table} {', '.join(clauses)}"
+        for algorithm, lock in ONLINE_ALGORITHMS:
+            options = ''.join([f", ALGORITHM={algorithm}" if algorithm else '', f", LOCK={lock}" if lock else ''])
+            try:
+                return [self.timed(connection, statement + options, algorithm or 'DEFAULT')]
+            except OperationalError as e:
+                if e.orig.args[0] not in ALTER_NOT_SUPPORTED or algorithm is None:
+                    raise
+                self.log(f"   ↪ ALGORITHM={algorithm} not supported here, trying the next option")
+
+    @staticmethod
+    def portable_statements(table, clauses):
+        """SQLite and others cannot batch an ALTER; split it into one statement per clause."""
+        statements = []
+        for clause in clauses:
+            if clause.startswith('ADD COLUMN'):
+                statements.append(f"ALTER TABLE {table} {clause}")
+            elif clause.startswith(('ADD INDEX', 'ADD UNIQUE INDEX')):
+                unique = 'UNIQUE ' if clause.startswith('ADD UNIQUE') else ''
+                name, columns = clause.split('INDEX ', 1)[1].split(' ', 1)
+                statements.append(f"CREATE {unique}INDEX {name} ON {table} {columns}")
+            elif clause.startswith('DROP INDEX'):
+                statements.append(clause)
+        return statements
+
+    def timed(self, connection, statement, algorithm):
+        started = time.perf_counter()
+        connection.execute(text(statement))
+        connection.commit()
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.log(f"   ✔ {statement} ({duration_ms} ms)")
+        return {'statement': statement, 'algorithm': algorithm, 'duration_ms': duration_ms}
+
+    def apply(self, connection, migration):
+        started = time.perf_counter()
+        steps = []
+        for kind, table, payload in self.plan(connection, migration):
+            if kind == 'alter':
+                steps += self.alter(connection, table, payload)
+                continue
+            step_started = time.perf_counter()
+            done = payload.run(connection)
+            connection.commit()
+            duration_ms = round((time.perf_counter() - step_started) * 1000, 1)
+            for statement in done:
+                self.log(f"   ✔ {statement} ({duration_ms} ms)")
+                steps.append({'statement': statement, 'algorithm': None, 'duration_ms': duration_ms})
+
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        connection.execute(SchemaVersion.__table__.insert().values(
+            version=migration.version, description=migration.description, duration_ms=duration_ms, steps=steps))
+        connection.commit()
+        return duration_ms, steps
+
+    def migrate(self, target=None, dry_run=False):
+        """Apply pending migrations up to `target`; returns the versions applied (or planned, for a dry run)."""
+        with self.engine.connect() as connection:
+            locked = self.acquire_lock(connection)
+            try:
+                done = []
+                planned = {'tables': set(), 'changes': {}}
+                for migration in self.pending(connection, target, create=not dry_run):
+                    self.log(f"📝 {migration.version:03d} {migration.description}")
+                    if dry_run:
+                        for kind, table, payload in self.plan(connection, migration, planned):
+                            self.log(f"   • ALTER TABLE {table} {', '.join(payload)}" if kind == 'alter'
+                                     else f"   • {payload.describe()}")
+                    else:
+                        duration_ms, steps = self.apply(connection, migration)
+                        self.log(f"✅ {migration.version:03d} applied in {duration_ms} ms "
+                                 f"({len(steps)} statement{'s' if len(steps) != 1 else ''})\n")
+                    done.append(migration.version)
+                return done
+            finally:
+                if locked:
+                    connection.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': MIGRATION_LOCK})
+
+    def acquire_lock(self, connection):
+        """Serialize concurrent runs (e.g. several app servers deploying at once) on MySQL."""
+        if connection.dialect.name != 'mysql':
+            return False
+        acquired = connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                      {'name': MIGRATION_LOCK, 'timeout': MIGRATION_LOCK_TIMEOUT}).scalar()
+        if acquired != 1:
+            raise MigrationError("Another migration run holds the lock; try again when it finishes")
+        return True
+
+    def status(self):
+        """[(version, description, applied_at or None, duration_ms or None)] for every known migration."""
+        with self.engine.connect() as connection:
+            applied = self.applied(connection)
+        return [(migration.version, migration.description,
+                 applied[migration.version].applied_at if migration.version in applied else None,
+                 applied[migration.version].duration_ms if migration.version in applied else None)
+                for migration in self.migrations]
@@ -0,0 +1,37 @@
+import argparse
+import time
+
+from app import app, db, process_payment_events
+
+
+def run_worker(poll_interval=1.0, batch_size=100, once=False):
+    print(f"💳 Payment worker started (batch size {batch_size})")
+    try:
+        while True:
+            with app.app_context():
+                try:
+                    handled = process_payment_events(batch_size=batch_size)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Payment worker error: {e}")
+                    handled = 0
+                finally:
+                    db.session.remove()
+            if handled:
+                print(f"✅ Applied {handled} payment event(s)")
+            if once:
+                break
+            # Keep draining while there is a backlog, otherwise poll
+            if handled < batch_size:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("\n👋 Payment worker stopped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply queued payment webhook events to orders.')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds to wait when the queue is empty')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--once', action='store_true', help='process a single batch and exit')
+    args = parser.parse_args()
+    run_worker(poll_interval=args.poll_interval, batch_size=args.batch_size, once=args.once)
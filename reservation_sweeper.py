@@ -0,0 +1,37 @@
+import argparse
+import time
+
+from app import app, db, release_expired_reservations, RESERVATION_MINUTES
+
+
+def run_sweeper(interval=30.0, batch_size=500, once=False):
+    print(f"⏳ Reservation sweeper started (reservations last {RESERVATION_MINUTES} min, batch size {batch_size})")
+    try:
+        while True:
+            with app.app_context():
+                try:
+                    expired = release_expired_reservations(batch_size=batch_size)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Reservation sweeper error: {e}")
+                    expired = 0
+                finally:
+                    db.session.remove()
+            if expired:
+                print(f"📦 Released stock from {expired} expired order(s)")
+            if once:
+                break
+            # A full batch means more may be waiting, so sweep again straight away
+            if expired < batch_size:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\n👋 Reservation sweeper stopped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Release stock held by unpaid orders whose reservation has expired.')
+    parser.add_argument('--interval', type=float, default=30.0, help='seconds between sweeps')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--once', action='store_true', help='run a single sweep and exit')
+    args = parser.parse_args()
+    run_sweeper(interval=args.interval, batch_size=args.batch_size, once=args.once)
@@ -0,0 +1,252 @@
+"""Generate a large synthetic catalog and order history for capacity testing.
+
+Rows go out as executemany batches of one compiled INSERT (PyMySQL rewrites
+each batch into multi-row INSERT statements) inside long transactions with no
+autocommit. Ids are assigned up front so child rows never wait for a round
+trip, and on MySQL unique/foreign-key checks are switched off for the loading
+session only.
+
+    python seed_data.py --products 1000000 --customers 200000 --orders 2000000
+    python seed_data.py --products 5000 --orders 20000 --database-url sqlite:///bench.db
+
+Every generated customer can log in with --password (default "seed-password").
+"""
+import argparse
+import os
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+
+# Category family -> (name stems, sizes it is stocked in, price range)
+CATALOG = {
+    'T-Shirts': (['Essential Tee', 'Graphic Tee', 'Pocket Tee', 'Oversized Tee'],
+                 ['XS', 'S', 'M', 'L', 'XL', '2XL'], (199, 899)),
+    'Hoodies': (['Pullover Hoodie', 'Zip Hoodie', 'Heavyweight Hoodie'], ['S', 'M', 'L', 'XL', '2XL'], (899, 2499)),
+    'Jackets': (['Bomber Jacket', 'Denim Jacket', 'Windbreaker', 'Coach Jacket'], ['S', 'M', 'L', 'XL'],
+                (1499, 4999)),
+    'Pants': (['Relaxed Jeans', 'Cargo Pants', 'Chinos', 'Track Pants'], ['28', '30', '32', '34', '36', '38', '40'],
+              (799, 2999)),
+    'Shorts': (['Denim Shorts', 'Mesh Shorts', 'Cargo Shorts'], ['28', '30', '32', '34', '36'], (399, 1299)),
+    'Accessories': (['Minimalist Cap', 'Bucket Hat', 'Tote Bag', 'Crew Socks', 'Beanie'], ['OS'], (149, 999)),
+}
+COLORS = ['Black', 'White', 'Heather Grey', 'Navy', 'Olive', 'Cream', 'Maroon', 'Sand', 'Forest', 'Washed Blue']
+FIRST_NAMES = ['Juan', 'Maria', 'Jose', 'Ana', 'Mark', 'Angel', 'John', 'Mary', 'Paolo', 'Nicole', 'Carlo', 'Bea',
+               'Miguel', 'Kristine', 'Rafael', 'Camille', 'Gabriel', 'Patricia', 'Adrian', 'Andrea']
+LAST_NAMES = ['Santos', 'Reyes', 'Cruz', 'Bautista', 'Ocampo', 'Garcia', 'Mendoza', 'Torres', 'Flores', 'Villanueva',
+              'Ramos', 'Aquino', 'Castillo', 'Rivera', 'De Leon', 'Navarro', 'Domingo', 'Gonzales']
+CITIES = ['Quezon City', 'Manila', 'Makati', 'Pasig', 'Taguig', 'Cebu City', 'Davao City', 'Baguio', 'Iloilo City']
+ORDER_STATUSES = [('Completed', 70), ('Processing', 12), ('Pending', 8), ('Cancelled', 7), ('Expired', 3)]
+PAYMENT_METHODS = ['cod', 'gcash', 'maya', 'credit_card', 'bank_transfer']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk-load synthetic products, customers and orders.')
+    parser.add_argument('--database-url', help='defaults to DATABASE_URL or the MySQL settings in .env')
+    parser.add_argument('--categories', type=int, default=60, help='spread over the families in CATALOG')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--customers', type=int, default=20000)
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--max-lines', type=int, default=5, help='most order_details rows per order')
+    parser.add_argument('--days', type=int, default=730, help='spread order dates over this many days')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per executemany batch')
+    parser.add_argument('--commit-every', type=int, default=100000, help='rows per transaction')
+    parser.add_argument('--password', default='seed-password')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+class BulkLoader:
+    """Writes row dicts in executemany batches on one connection, committing every `commit_every` rows."""
+
+    def __init__(self, connection, batch_size=5000, commit_every=100000):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.counts = {}
+        self._uncommitted = 0
+        self._transaction = connection.begin()
+
+    def load(self, table, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._flush(table, batch)
+                batch = []
+        if batch:
+            self._flush(table, batch)
+
+    def _flush(self, table, batch):
+        self.connection.execute(table.insert(), batch)
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(batch)
+        self._uncommitted += len(batch)
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+            self._transaction = self.connection.begin()
+
+    def commit(self):
+        self._transaction.commit()
+        self._uncommitted = 0
+
+
+def next_id(connection, table):
+    return (connection.exec_driver_sql(f"SELECT MAX(id) FROM {table.name}").scalar() or 0) + 1
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+def generate_categories(first_id, count, now):
+    families = list(CATALOG)
+    for i in range(count):
+        family = families[i % len(families)]
+        yield {'id': first_id + i, 'name': f"{family} {first_id + i}", 'description': f"Synthetic {family.lower()}",
+               'created_at': now, 'is_deleted': False}
+
+
+def generate_products(rng, first_id, count, categories, now, prices, families):
+    """Products plus their size rows.
+
+    `prices` and `families` (an index into CATALOG per product) are filled in
+    for the order generator, which keeps millions of products in memory cheaply.
+    """
+    family_names = list(CATALOG)
+    for i in range(count):
+        product_id = first_id + i
+        category_id, family = categories[i % len(categories)]
+        stems, sizes, (low, high) = CATALOG[family]
+        price = round(rng.uniform(low, high) / 50) * 50 - 0.01
+        prices.append(price)
+        families.append(family_names.index(family))
+        product = {
+            'id': product_id, 'product_code': f"SD{product_id:09d}",
+            'name': f"{rng.choice(stems)} {product_id}", 'description': None,
+            'category_id': category_id, 'color': rng.choice(COLORS), 'price': price,
+            'image_filename': None, 'created_at': now - timedelta(days=rng.randint(0, 1000)),
+            'updated_at': now, 'is_deleted': rng.random() < 0.02,
+        }
+        # Most products carry a contiguous run of sizes; a few are out of stock in some of them
+        start = rng.randint(0, max(0, len(sizes) - 3))
+        levels = [{'product_id': product_id, 'size': size,
+                   'quantity': 0 if rng.random() < 0.08 else int(rng.paretovariate(1.5) * 5)}
+                  for size in sizes[start:start + rng.randint(1, len(sizes))]]
+        yield product, levels
+
+
+def generate_people(rng, first_user_id, first_customer_id, count, password_hash, now):
+    for i in range(count):
+        user_id, customer_id = first_user_id + i, first_customer_id + i
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        joined = now - timedelta(days=rng.randint(0, 1000))
+        user = {'id': user_id, 'username': f"shopper{user_id}", 'email': f"shopper{user_id}@example.com",
+                'password_hash': password_hash, 'role': 'User', 'created_at': joined, 'is_active': True}
+        customer = {'id': customer_id, 'first_name': first_name, 'last_name': last_name,
+                    'email': f"customer{customer_id}@example.com", 'phone': f"09{rng.randint(100000000, 999999999)}",
+                    'address': f"{rng.randint(1, 999)} Rizal St., {rng.choice(CITIES)}", 'created_at': joined,
+                    'is_deleted': False, 'user_id': user_id}
+        yield user, [customer]
+
+
+def generate_orders(rng, first_order_id, count, customer_ids, product_ids, prices, families, max_lines, days, now):
+    """Orders with their lines; a few products and repeat customers account for most of them."""
+    family_sizes = [sizes for _, sizes, _ in CATALOG.values()]
+    for i in range(count):
+        order_id = first_order_id + i
+        lines, total = [], 0.0
+        for _ in range(rng.randint(1, max_lines)):
+            index = int(len(product_ids) * rng.random() ** 3)
+            quantity = rng.choice((1, 1, 1, 2, 2, 3))
+            lines.append({'order_id': order_id, 'product_id': product_ids[index],
+                          'size': rng.choice(family_sizes[families[index]]),
+                          'quantity': quantity, 'price': prices[index]})
+            total += quantity * prices[index]
+        status = weighted(rng, ORDER_STATUSES)
+        payment_status = 'Paid' if status in ('Completed', 'Processing') else \
+            'Unpaid' if status in ('Pending', 'Expired') else rng.choice(('Unpaid', 'Failed'))
+        order = {'id': order_id, 'customer_id': customer_ids[int(len(customer_ids) * rng.random() ** 2)],
+                 'order_date': now - timedelta(seconds=rng.randint(0, days * 86400)),
+                 'total_amount': round(total, 2), 'status': status,
+                 'payment_method': rng.choice(PAYMENT_METHODS), 'payment_status': payment_status,
+                 'payment_reference': None, 'reserved_until': None, 'idempotency_key': None, 'is_deleted': False}
+        yield order, lines
+
+
+def split(pairs, first_table, second_table, loader):
+    """Feed (parent, children) pairs to the loader, parents always a batch ahead of their children."""
+    parents, children = [], []
+    for parent, child_rows in pairs:
+        parents.append(parent)
+        children.extend(child_rows)
+        if len(parents) >= loader.batch_size:
+            loader.load(first_table, parents)
+            loader.load(second_table, children)
+            parents, children = [], []
+    loader.load(first_table, parents)
+    loader.load(second_table, children)
+
+
+def seed_data(shop, args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    started = time.monotonic()
+    categories_table, products_table, sizes_table = \
+        shop.Category.__table__, shop.Product.__table__, shop.ProductSize.__table__
+    users_table, customers_table = shop.User.__table__, shop.Customer.__table__
+    orders_table, details_table = shop.Order.__table__, shop.OrderDetail.__table__
+
+    with shop.app.app_context():
+        shop.db.create_all()
+        with shop.db.engine.connect() as connection:
+            mysql = connection.dialect.name == 'mysql'
+            if mysql:
+                connection.exec_driver_sql("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+            elif connection.dialect.name == 'sqlite':
+                connection.exec_driver_sql("PRAGMA synchronous = OFF")
+            connection.commit()
+            loader = BulkLoader(connection, batch_size=args.batch_size, commit_every=args.commit_every)
+
+            print(f"🗂️  Generating {args.categories} categories and {args.products:,} products...")
+            first_category = next_id(connection, categories_table)
+            loader.load(categories_table, generate_categories(first_category, args.categories, now))
+            categories = [(first_category + i, list(CATALOG)[i % len(CATALOG)]) for i in range(args.categories)]
+            first_product = next_id(connection, products_table)
+            prices, families = array('d'), array('B')
+            split(generate_products(rng, first_product, args.products, categories, now, prices, families),
+                  products_table, sizes_table, loader)
+            product_ids = range(first_product, first_product + args.products)
+
+            print(f"👥 Generating {args.customers:,} customers...")
+            password_hash = shop.generate_password_hash(args.password)
+            first_user, first_customer = next_id(connection, users_table), next_id(connection, customers_table)
+            split(generate_people(rng, first_user, first_customer, args.customers, password_hash, now),
+                  users_table, customers_table, loader)
+            customer_ids = range(first_customer, first_customer + args.customers)
+
+            print(f"🧾 Generating {args.orders:,} orders...")
+            split(generate_orders(rng, next_id(connection, orders_table), args.orders, customer_ids, product_ids,
+                                  prices, families, args.max_lines, args.days, now),
+                  orders_table, details_table, loader)
+
+            loader.commit()
+            if mysql:
+                connection.exec_driver_sql("SET SESSION unique_checks = 1, foreign_key_checks = 1")
+
+    elapsed = time.monotonic() - started
+    total = sum(loader.counts.values())
+    print(f"\n✅ Inserted {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+    for table, count in loader.counts.items():
+        print(f"   {table:<15} {count:>12,}")
+    return True
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.database_url:
+        # Must be set before app.py is imported, which reads it at module level
+        os.environ['DATABASE_URL'] = arguments.database_url
+    import app as shop_app
+    if not seed_data(shop_app, arguments):
+        exit(1)
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+# app.py reads DATABASE_URL at import time
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as shop  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory schema per test; views render to their template name."""
+    monkeypatch.setattr(shop, 'render_template', lambda template, **context: template)
+    shop.app.config['TESTING'] = True
+    with shop.app.app_context():
+        shop.db.create_all()
+        yield shop.db
+        shop.db.session.remove()
+        shop.db.drop_all()
+    shop._principal_cache.clear()
+    shop._count_cache.clear()
+
+
+@pytest.fixture
+def users(db):
+    customer = shop.User(username='bob', email='bob@example.com', role='User')
+    customer.set_password('secret1')
+    admin = shop.User(username='adm', email='adm@example.com', role='Admin')
+    admin.set_password('secret1')
+    db.session.add_all([customer, admin])
+    db.session.commit()
+    return customer.id, admin.id
+
+
+@pytest.fixture
+def products(db):
+    """Five products with sizes M (5 in stock) and L (2 in stock); returns their ids."""
+    category = shop.Category(name='Tees')
+    db.session.add(category)
+    db.session.flush()
+    items = [shop.Product(product_code=f'P{i:03}', name=f'Item {i}', color='Red', price=10 + i,
+                          category_id=category.id, size_quantities={'M': 5, 'L': 2})
+             for i in range(5)]
+    db.session.add_all(items)
+    db.session.commit()
+    return [product.id for product in items]
+
+
+def login(user_id, role='User'):
+    client = shop.app.test_client()
+    # Requests run inside the fixture's app context and so share its g; drop the last user's
+    for name in list(shop.g):
+        shop.g.pop(name)
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['role'] = role
+        session['username'] = 'test'
+    return client
+
+
+def stock(product_id, size):
+    return shop.db.session.execute(
+        shop.db.select(shop.ProductSize.quantity)
+        .where(shop.ProductSize.product_id == product_id, shop.ProductSize.size == size)).scalar()
+
+
+def place_order(client, user_id, lines, key='key-1'):
+    """Check out {(product_id, size): quantity} through the real checkout view; returns the response."""
+    shop.cart_store.save(user_id, {f'{product_id}_{size}': [quantity, 10.0]
+                                   for (product_id, size), quantity in lines.items()})
+    return client.post('/checkout', data={'first_name': 'Bob', 'last_name': 'Stone', 'email': 'bob@example.com',
+                                          'phone': '0917', 'address': 'Manila', 'idempotency_key': key})
@@ -0,0 +1,29 @@
+from conftest import login, shop
+
+
+def test_profiling_reset_needs_a_post(db, users):
+    _, admin_id = users
+    client = login(admin_id, 'Admin')
+    shop.request_profiler.record('shop', 12.0, 3, 1.5, 10)
+    client.get('/admin/profiling?reset=1')
+    assert 'shop' in shop.request_profiler._samples
+    assert client.post('/admin/profiling/reset').get_json() == {'reset': True}
+    assert 'shop' not in shop.request_profiler._samples
+
+
+def test_profiling_reset_is_admin_only(db, users):
+    customer_id, _ = users
+    shop.request_profiler.record('shop', 12.0, 3, 1.5, 10)
+    login(customer_id).post('/admin/profiling/reset')
+    assert 'shop' in shop.request_profiler._samples
+    shop.request_profiler.reset()
+
+
+def test_slow_query_reset_needs_a_post(db, users):
+    _, admin_id = users
+    client = login(admin_id, 'Admin')
+    shop.slow_query_log.record('select ?', 'SELECT 1', 900.0, 'shop')
+    client.get('/admin/slow-queries?reset=1')
+    assert 'select ?' in shop.slow_query_log._entries
+    assert client.post('/admin/slow-queries/reset').get_json() == {'reset': True}
+    assert 'select ?' not in shop.slow_query_log._entries
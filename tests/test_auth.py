@@ -0,0 +1,11 @@
+from conftest import shop
+
+
+def test_principal_cache_is_bounded(db, users, monkeypatch):
+    customer, admin = users
+    monkeypatch.setattr(shop, 'PRINCIPAL_CACHE_MAX_KEYS', 2)
+    for user_id in (customer, admin, 999, customer):
+        shop.load_principal(user_id)
+    assert list(shop._principal_cache) == [999, customer]
+    assert shop.load_principal(customer).username == 'bob'
+    assert shop.load_principal(999) is None
@@ -0,0 +1,34 @@
+from conftest import login, shop
+
+
+def test_legacy_session_cart_is_read(db):
+    legacy = {'3_M': {'product_id': 3, 'size': 'M', 'quantity': 2, 'price': 12.5, 'name': 'Tee'}}
+    assert shop.unpack_cart(legacy) == {'3_M': {'product_id': 3, 'size': 'M', 'quantity': 2, 'price': 12.5}}
+
+
+def test_malformed_cart_entries_are_dropped(db):
+    packed = {'1_M': [1, 10.0], 'junk': 'x', '2_L': {'size': 'L'}}
+    assert list(shop.unpack_cart(packed)) == ['1_M']
+
+
+def test_legacy_cookie_cart_moves_to_the_store(db, users, products):
+    customer_id, _ = users
+    client = login(customer_id)
+    with client.session_transaction() as session:
+        session['cart'] = {f'{products[0]}_M': {'product_id': products[0], 'size': 'M', 'quantity': 1,
+                                                'price': 10.0}}
+    with client:
+        client.get('/cart')
+        assert shop.get_cart()[f'{products[0]}_M']['quantity'] == 1
+        with client.session_transaction() as session:
+            assert 'cart' not in session
+    assert shop.cart_store.load(customer_id) == {f'{products[0]}_M': [1, 10.0]}
+
+
+def test_sql_store_upserts(db, users):
+    customer_id, _ = users
+    store = shop.SqlCartStore(shop.app.config['CART_TTL'])
+    store.save(customer_id, {'1_M': [1, 10.0]})
+    store.save(customer_id, {'1_M': [3, 10.0]})
+    assert store.load(customer_id) == {'1_M': [3, 10.0]}
+    assert shop.db.session.query(shop.Cart).count() == 1
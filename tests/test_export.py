@@ -0,0 +1,16 @@
+import csv
+from io import StringIO
+
+from conftest import login, shop
+
+
+def test_export_totals(db, users, products):
+    _, admin_id = users
+    shop.take_stock({(products[0], 'M'): 5})
+    db.session.commit()
+    response = login(admin_id, 'Admin').get('/products/export')
+    rows = list(csv.DictReader(StringIO(response.get_data(as_text=True))))
+    assert len(rows) == 5
+    first = next(row for row in rows if row['Product Code'] == 'P000')
+    assert (first['Total Quantity'], first['Total Value']) == ('2', '20.00')
+    assert first['Size Breakdown'] in ("{'L': 2, 'M': 0}", "{'M': 0, 'L': 2}")
@@ -0,0 +1,74 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from conftest import shop
+
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'renditions')
+    monkeypatch.setitem(shop.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path
+
+
+def png_bytes():
+    buffer = BytesIO()
+    shop.Image.new('RGB', (40, 30), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.mark.skipif(shop.Image is None, reason='Pillow is not installed')
+def test_same_bytes_share_one_file(db, upload_folder):
+    first = shop.store_product_image(png_bytes(), 'PNG')
+    assert shop.store_product_image(png_bytes(), 'png') == first
+    assert sorted(os.listdir(upload_folder)) == [first, 'renditions']
+    assert first in shop.image_manifest
+
+
+def broken_renditions(*args):
+    raise OSError('disk full')
+
+
+def test_failed_store_keeps_a_shared_file(db, upload_folder, monkeypatch):
+    monkeypatch.setattr(shop, 'Image', object())
+    monkeypatch.setattr(shop, 'generate_renditions', lambda *args: None)
+    existing = shop.store_product_image(b'shared bytes', 'jpg')
+    monkeypatch.setattr(shop, 'generate_renditions', broken_renditions)
+    assert shop.store_product_image(b'shared bytes', 'jpg') is None
+    assert os.path.exists(upload_folder / existing)
+    assert existing in shop.image_manifest
+
+
+def test_failed_store_removes_its_own_file(db, upload_folder, monkeypatch):
+    monkeypatch.setattr(shop, 'Image', object())
+    monkeypatch.setattr(shop, 'generate_renditions', broken_renditions)
+    assert shop.store_product_image(b'fresh bytes', 'jpg') is None
+    assert os.listdir(upload_folder) == ['renditions']
+
+
+def test_manifest_lookups_do_not_scan(upload_folder, monkeypatch):
+    manifest = shop.ImageManifest(str(upload_folder))
+    manifest.rebuild()
+    monkeypatch.setattr(manifest, 'start_refresher', lambda: None)
+    (upload_folder / 'late.jpg').write_bytes(b'x')
+    monkeypatch.setattr(shop.os, 'scandir', None)
+    assert 'late.jpg' not in manifest
+
+
+def test_manifest_rescan_keeps_concurrent_changes(upload_folder, monkeypatch):
+    (upload_folder / 'old.jpg').write_bytes(b'x')
+    manifest = shop.ImageManifest(str(upload_folder))
+    scandir = os.scandir
+
+    def racing_scandir(path):
+        # Another request stores one file and deletes another mid-scan
+        manifest.add('new.jpg')
+        manifest.discard('old.jpg')
+        return scandir(path)
+    monkeypatch.setattr(shop.os, 'scandir', racing_scandir)
+    manifest.rebuild()
+    monkeypatch.setattr(manifest, 'start_refresher', lambda: None)
+    assert 'new.jpg' in manifest
+    assert 'old.jpg' not in manifest
@@ -0,0 +1,38 @@
+import pytest
+
+from conftest import shop
+
+pytestmark = pytest.mark.skipif(shop.prometheus_client is None, reason='prometheus_client is not installed')
+
+
+def test_metrics_closed_without_a_token(db, monkeypatch):
+    monkeypatch.setattr(shop, 'METRICS_TOKEN', None)
+    assert shop.app.test_client().get('/metrics').status_code == 404
+
+
+def test_metrics_can_be_opened_explicitly(db, monkeypatch):
+    monkeypatch.setattr(shop, 'METRICS_TOKEN', None)
+    monkeypatch.setattr(shop, 'METRICS_PUBLIC', True)
+    assert shop.app.test_client().get('/metrics').status_code == 200
+
+
+def test_metrics_token(db, monkeypatch):
+    monkeypatch.setattr(shop, 'METRICS_TOKEN', 's3cret')
+    client = shop.app.test_client()
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert b'shop_db_pool_checked_out' in response.data
+
+
+def sample(name):
+    return shop.prometheus_client.REGISTRY.get_sample_value(name) or 0
+
+
+def test_pool_events_track_checkouts(db):
+    in_use, held = sample('shop_db_pool_checked_out'), sample('shop_db_pool_hold_seconds_count')
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql('SELECT 1')
+        assert sample('shop_db_pool_checked_out') == in_use + 1
+    assert sample('shop_db_pool_checked_out') == in_use
+    assert sample('shop_db_pool_hold_seconds_count') == held + 1
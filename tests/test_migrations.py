@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from conftest import shop
+from migrations import MIGRATIONS, AddIndex, Migration, MigrationError, MigrationRunner, TableSchema, \
+    copy_size_quantities
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'shop.db'}")
+    shop.db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def runner(engine, migrations=MIGRATIONS):
+    return MigrationRunner(engine, migrations, log=lambda *args: None)
+
+
+def test_current_schema_is_recorded_then_left_alone(engine):
+    assert runner(engine).migrate() == [migration.version for migration in MIGRATIONS]
+    assert runner(engine).migrate() == []
+    assert all(applied_at for _, _, applied_at, _ in runner(engine).status())
+
+
+def test_target_and_dry_run(engine):
+    assert runner(engine).migrate(target=3, dry_run=True) == [1, 2, 3]
+    assert runner(engine).migrate(target=3) == [1, 2, 3]
+    assert runner(engine).migrate(dry_run=True)[0] == 4
+
+
+def test_missing_columns_and_indexes_are_added(engine):
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_products_recent"))
+        connection.execute(text("DROP INDEX ix_orders_reserved_until"))
+        connection.execute(text("ALTER TABLE orders DROP COLUMN reserved_until"))
+        connection.execute(text("ALTER TABLE email_outbox DROP COLUMN claimed_at"))
+    runner(engine).migrate()
+    with engine.connect() as connection:
+        assert 'ix_products_recent' in TableSchema.load(connection, 'products').indexes
+        orders = TableSchema.load(connection, 'orders')
+        assert 'reserved_until' in orders.columns and 'ix_orders_reserved_until' in orders.indexes
+        assert 'claimed_at' in TableSchema.load(connection, 'email_outbox').columns
+
+
+def test_legacy_size_keys_are_merged(engine):
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE products ADD COLUMN size_quantities JSON NOT NULL DEFAULT '{}'"))
+        connection.execute(text("INSERT INTO categories (id, name, is_deleted) VALUES (1, 'Tees', 0)"))
+        connection.execute(text(
+            "INSERT INTO products (id, product_code, name, category_id, color, price, is_deleted, size_quantities) "
+            "VALUES (1, 'P1', 'Tee', 1, 'Red', 10, 0, '{\"shirt_M\": 2, \"M\": 3, \"shirt_L\": 1}')"))
+        assert copy_size_quantities(connection) == 'copied 2 size rows into product_size'
+        rows = connection.execute(text("SELECT size, quantity FROM product_size ORDER BY size")).all()
+        assert 'size_quantities' not in TableSchema.load(connection, 'products').columns
+    assert [tuple(row) for row in rows] == [('L', 1), ('M', 5)]
+
+
+def test_fulltext_index_is_mysql_only():
+    op = AddIndex('products', 'ft_products_search', ('product_code', 'name', 'color'), fulltext=True)
+    empty = TableSchema({}, {})
+    assert op.clause(empty, 'sqlite') is None
+    assert op.clause(empty, 'mysql') == 'ADD FULLTEXT INDEX ft_products_search (product_code, name, color)'
+
+
+def test_duplicate_versions_are_refused(engine):
+    with pytest.raises(MigrationError):
+        runner(engine, [Migration(1, 'a'), Migration(1, 'b')])
+
+
+def test_dry_run_on_a_database_that_is_behind(engine):
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE schema_version"))
+        connection.execute(text("DROP TABLE email_outbox"))
+        connection.execute(text("DROP TABLE carts"))
+        connection.execute(text("DROP INDEX ix_products_recent"))
+    logged = []
+    dry = MigrationRunner(engine, log=logged.append)
+    assert dry.migrate(dry_run=True) == [migration.version for migration in MIGRATIONS]
+    assert '   • CREATE TABLE email_outbox' in logged
+    # Migration 9 alters email_outbox, which migration 5 creates with claimed_at already in it
+    assert not any('ALTER TABLE email_outbox' in line for line in logged)
+    assert sum('ix_products_recent' in line for line in logged) == 1
+    with engine.connect() as connection:
+        assert not TableSchema.load(connection, 'email_outbox')
+        assert not TableSchema.load(connection, 'schema_version')
+    assert all(applied_at is None for _, _, applied_at, _ in dry.status())
+    with engine.connect() as connection:
+        assert not TableSchema.load(connection, 'schema_version')
+    runner(engine).migrate()
+    with engine.connect() as connection:
+        assert 'claimed_at' in TableSchema.load(connection, 'email_outbox').columns
@@ -0,0 +1,55 @@
+from conftest import login, place_order, shop, stock
+
+
+def test_checkout_takes_stock(db, users, products):
+    customer_id, _ = users
+    response = place_order(login(customer_id), customer_id, {(products[0], 'M'): 2, (products[1], 'L'): 1})
+    order = shop.Order.query.one()
+    assert response.location.endswith(f'/payment/select/{order.id}')
+    assert (stock(products[0], 'M'), stock(products[1], 'L')) == (3, 1)
+    assert order.reserved_until is not None
+
+
+def test_checkout_replay_returns_the_same_order(db, users, products):
+    customer_id, _ = users
+    client = login(customer_id)
+    first = place_order(client, customer_id, {(products[0], 'M'): 2})
+    again = place_order(client, customer_id, {(products[0], 'M'): 2})
+    assert shop.Order.query.count() == 1
+    assert again.location == first.location
+    assert stock(products[0], 'M') == 3
+
+
+def test_checkout_refuses_oversell(db, users, products):
+    customer_id, _ = users
+    place_order(login(customer_id), customer_id, {(products[0], 'L'): 3})
+    assert shop.Order.query.count() == 0
+    assert stock(products[0], 'L') == 2
+
+
+def set_status(admin_id, order_id, status):
+    return login(admin_id, 'Admin').post(f'/admin/orders/{order_id}/status', data={'status': status})
+
+
+def test_cancel_and_reopen_moves_stock(db, users, products):
+    customer_id, admin_id = users
+    place_order(login(customer_id), customer_id, {(products[0], 'M'): 2})
+    order_id = shop.Order.query.one().id
+    set_status(admin_id, order_id, 'Cancelled')
+    assert stock(products[0], 'M') == 5
+    set_status(admin_id, order_id, 'Processing')
+    assert stock(products[0], 'M') == 3
+    assert db.session.get(shop.Order, order_id).status == 'Processing'
+
+
+def test_reopen_without_stock_is_refused(db, users, products):
+    customer_id, admin_id = users
+    place_order(login(customer_id), customer_id, {(products[0], 'M'): 2})
+    order_id = shop.Order.query.one().id
+    set_status(admin_id, order_id, 'Cancelled')
+    assert shop.take_stock({(products[0], 'M'): 4})
+    db.session.commit()
+    set_status(admin_id, order_id, 'Processing')
+    db.session.expire_all()
+    assert db.session.get(shop.Order, order_id).status == 'Cancelled'
+    assert stock(products[0], 'M') == 1
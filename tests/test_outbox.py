@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from conftest import shop
+
+
+class RecordingSender:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    def send(self, message):
+        if self.fail:
+            raise OSError('connection refused')
+        self.sent.append(message['To'])
+
+    def close(self):
+        pass
+
+
+def queue(db, count=1, **fields):
+    emails = [shop.OutboxEmail(to_email=f'u{i}@example.com', subject='Code', html_body='OTP 123456', **fields)
+              for i in range(count)]
+    db.session.add_all(emails)
+    db.session.commit()
+    return emails
+
+
+def test_sent_emails_lose_their_body(db):
+    queue(db, 2)
+    sender = RecordingSender()
+    assert shop.deliver_outbox_batch(sender) == 2
+    assert sorted(sender.sent) == ['u0@example.com', 'u1@example.com']
+    rows = shop.OutboxEmail.query.all()
+    assert {(row.status, row.html_body, row.claimed_at) for row in rows} == {('Sent', '', None)}
+    assert shop.deliver_outbox_batch(sender) == 0
+
+
+def test_failed_send_is_released_for_retry(db):
+    email, = queue(db)
+    assert shop.deliver_outbox_batch(RecordingSender(fail=True)) == 1
+    db.session.refresh(email)
+    assert (email.status, email.attempts, email.html_body) == ('Pending', 1, 'OTP 123456')
+    assert email.next_attempt_at > datetime.utcnow()
+
+
+def test_claimed_emails_are_skipped_until_the_claim_is_stale(db):
+    now = datetime.utcnow()
+    queue(db, status='Sending', claimed_at=now)
+    stale, = queue(db, status='Sending', claimed_at=now - timedelta(hours=1))
+    claimed = shop.claim_outbox_batch()
+    assert [email.id for email in claimed] == [stale.id]
+
+
+def test_purge_keeps_pending_and_recent_emails(db):
+    old = datetime.utcnow() - timedelta(days=shop.EMAIL_RETENTION_DAYS + 1)
+    queue(db, status='Sent', created_at=old)
+    queue(db, status='Failed', created_at=old)
+    queue(db, status='Pending', created_at=old)
+    queue(db, status='Sent')
+    assert shop.purge_outbox() == 2
+    assert sorted(email.status for email in shop.OutboxEmail.query.all()) == ['Pending', 'Sent']
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+from conftest import shop
+
+
+def test_keyset_pages_cover_every_row_once(db, products):
+    db.session.add_all(shop.Product(product_code=f'Q{i:03}', name='Same name', color='Blue', price=1,
+                                    category_id=1) for i in range(25))
+    db.session.commit()
+    query = shop.Product.query.filter_by(is_deleted=False)
+    columns = [shop.Product.name, shop.Product.id]
+
+    seen, after = [], None
+    with shop.app.test_request_context():
+        while True:
+            page = shop.keyset_paginate(query, columns, after=after, per_page=7, count_key=('test',))
+            seen += [(product.name, product.id) for product in page.items]
+            assert page.total == 30
+            if not page.has_next:
+                break
+            after = page.next_cursor
+
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen)) == 30
+
+
+def test_keyset_descending_by_date(db, products):
+    now = datetime(2026, 1, 1)
+    customer = shop.Customer(first_name='A', last_name='B', email='a@example.com', user_id=1)
+    db.session.add(customer)
+    db.session.flush()
+    # Pairs of orders share a timestamp so the id tie-breaker matters
+    db.session.add_all(shop.Order(customer_id=customer.id, total_amount=1, order_date=now - timedelta(hours=i // 2))
+                       for i in range(9))
+    db.session.commit()
+
+    ids, after = [], None
+    with shop.app.test_request_context():
+        while True:
+            page = shop.keyset_paginate(shop.Order.query, [shop.Order.order_date, shop.Order.id], after=after,
+                                        per_page=4, descending=True)
+            ids += [order.id for order in page.items]
+            if not page.has_next:
+                break
+            after = page.next_cursor
+    expected = [order.id for order in shop.Order.query.order_by(shop.Order.order_date.desc(),
+                                                                   shop.Order.id.desc())]
+    assert ids == expected
+
+
+def test_malformed_cursor_starts_from_the_first_page(db, products):
+    with shop.app.test_request_context():
+        page = shop.keyset_paginate(shop.Product.query, [shop.Product.name, shop.Product.id],
+                                    after='not-a-cursor', per_page=2)
+    assert [product.name for product in page.items] == ['Item 0', 'Item 1']
+
+
+def test_cursor_values_must_match_the_column_types(db, products):
+    columns = [shop.Product.name, shop.Product.id]
+    for values in (['Item 1', 2], [['Item 1'], 2], [{'a': 1}, 2], ['Item 1', '2'], ['Item 1', [2]], [None, 2]):
+        token = shop.encode_cursor(values)
+        assert (shop.decode_cursor(token, columns) is not None) == (values == ['Item 1', 2])
+        with shop.app.test_request_context():
+            page = shop.keyset_paginate(shop.Product.query, columns, after=token, per_page=2)
+        assert [product.name for product in page.items] == (['Item 2', 'Item 3'] if values == ['Item 1', 2]
+                                                             else ['Item 0', 'Item 1'])
+    orders = [shop.Order.order_date, shop.Order.id]
+    assert shop.decode_cursor(shop.encode_cursor([{'when': 1}, 1]), orders) is None
+
+
+def test_count_cache_is_bounded(db, products, monkeypatch):
+    monkeypatch.setattr(shop, 'COUNT_CACHE_MAX_KEYS', 3)
+    query = shop.Product.query.filter_by(is_deleted=False)
+    for key in range(10):
+        assert shop.cached_count(query, ('test', key)) == 5
+    assert list(shop._count_cache) == [('test', 7), ('test', 8), ('test', 9)]
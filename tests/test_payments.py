@@ -0,0 +1,83 @@
+import json
+
+import pytest
+import requests
+
+from conftest import shop
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, reason='OK'):
+        self.status_code = status_code
+        self.content = content.encode()
+        self.reason = reason
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def gateway(monkeypatch, *responses):
+    client = shop.PayMongoClient('sk_test', max_retries=0, breaker=shop.CircuitBreaker(failure_threshold=1))
+    queue = list(responses)
+    monkeypatch.setattr(client.session, 'request', lambda *args, **kwargs: queue.pop(0))
+    return client
+
+
+class Order:
+    id = 7
+    total_amount = 120.5
+
+
+def create(client):
+    return client.create_checkout_session(Order(), 'gcash', 'https://shop/ok', 'https://shop/cancel')
+
+
+def test_non_json_body_trips_the_breaker(monkeypatch):
+    client = gateway(monkeypatch, FakeResponse(200, '<html>Bad gateway</html>'))
+    with pytest.raises(shop.PaymentGatewayError):
+        create(client)
+    assert not client.breaker.allow()
+
+
+def test_html_rejection_is_a_gateway_error(monkeypatch):
+    client = gateway(monkeypatch, FakeResponse(404, '<html>Not found</html>', reason='Not Found'))
+    with pytest.raises(shop.PaymentGatewayError, match='Not Found'):
+        create(client)
+    assert client.breaker.allow()
+
+
+def test_checkout_session_without_url_is_rejected(monkeypatch):
+    client = gateway(monkeypatch, FakeResponse(200, '{"data": {"id": "cs_1", "attributes": {}}}'))
+    with pytest.raises(shop.PaymentGatewayError, match='checkout_url'):
+        create(client)
+
+
+def test_checkout_session(monkeypatch):
+    client = gateway(monkeypatch, FakeResponse(
+        200, '{"data": {"id": "cs_1", "attributes": {"checkout_url": "https://pay.example/cs_1"}}}'))
+    assert create(client)['id'] == 'cs_1'
+
+
+def raising(exc):
+    def request(*args, **kwargs):
+        raise exc
+    return request
+
+
+def test_other_request_errors_are_gateway_errors(monkeypatch):
+    client = gateway(monkeypatch)
+    monkeypatch.setattr(client.session, 'request', raising(requests.exceptions.ChunkedEncodingError('cut off')))
+    with pytest.raises(shop.PaymentGatewayError):
+        create(client)
+    assert not client.breaker.allow()
+
+
+def test_failed_trial_releases_the_breaker(monkeypatch):
+    client = gateway(monkeypatch)
+    client.breaker.reset_timeout = 0
+    client.breaker.record_failure()
+    monkeypatch.setattr(client.session, 'request', raising(RuntimeError('bug')))
+    with pytest.raises(RuntimeError):
+        create(client)
+    # The trial ended without an outcome; the next call gets its own trial
+    assert client.breaker.allow()
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login, place_order, shop, stock
+
+
+class FakeGateway:
+    configured = True
+
+    def create_checkout_session(self, order, payment_type, success_url, cancel_url):
+        return {'id': f'cs_{order.id}', 'attributes': {'checkout_url': 'https://pay.example/cs'}}
+
+
+@pytest.fixture
+def order_id(db, users, products):
+    customer_id, _ = users
+    place_order(login(customer_id), customer_id, {(products[0], 'M'): 2})
+    return shop.Order.query.one().id
+
+
+def lapse(order_id):
+    shop.db.session.get(shop.Order, order_id).reserved_until = datetime.utcnow() - timedelta(minutes=1)
+    shop.db.session.commit()
+
+
+def test_lapsed_reservation_is_released(db, products, order_id):
+    assert shop.release_expired_reservations() == 0
+    lapse(order_id)
+    assert shop.release_expired_reservations() == 1
+    db.session.expire_all()
+    order = db.session.get(shop.Order, order_id)
+    assert (order.status, order.reserved_until) == ('Expired', None)
+    assert stock(products[0], 'M') == 5
+    assert shop.release_expired_reservations() == 0
+
+
+def test_manual_payment_keeps_the_stock(db, users, products, order_id):
+    customer_id, _ = users
+    login(customer_id).post(f'/payment/process/{order_id}', data={'payment_method': 'cod'})
+    lapse(order_id)
+    assert shop.release_expired_reservations() == 0
+    assert stock(products[0], 'M') == 3
+
+
+def test_abandoned_gateway_checkout_is_released(db, users, products, order_id, monkeypatch):
+    customer_id, _ = users
+    monkeypatch.setattr(shop, 'payment_gateway', FakeGateway())
+    response = login(customer_id).get(f'/payment/create/{order_id}/gcash')
+    assert response.location == 'https://pay.example/cs'
+    order = db.session.get(shop.Order, order_id)
+    assert (order.payment_status, order.payment_reference) == ('Awaiting', f'cs_{order_id}')
+    lapse(order_id)
+    assert shop.release_expired_reservations() == 1
+    assert stock(products[0], 'M') == 5
+
+
+def test_expired_order_cannot_start_a_payment(db, users, order_id, monkeypatch):
+    customer_id, _ = users
+    monkeypatch.setattr(shop, 'payment_gateway', FakeGateway())
+    lapse(order_id)
+    shop.release_expired_reservations()
+    login(customer_id).get(f'/payment/create/{order_id}/gcash')
+    assert db.session.get(shop.Order, order_id).payment_reference is None
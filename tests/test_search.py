@@ -0,0 +1,39 @@
+import pytest
+
+from conftest import login, shop
+
+
+@pytest.fixture
+def catalog(db):
+    tees, caps = shop.Category(name='Tees'), shop.Category(name='Caps')
+    db.session.add_all([tees, caps])
+    db.session.flush()
+    # Tees score higher (the term is in the code too), so they fill a small cap first
+    db.session.add_all([shop.Product(product_code=f'RED{i}', name=f'Red Tee {i}', color='Red', price=10,
+                                     category_id=tees.id, size_quantities={'M': 1}) for i in range(6)])
+    db.session.add_all([shop.Product(product_code=f'C{i}', name=f'Cap {i}', color='Red', price=10,
+                                     category_id=caps.id, size_quantities={'M': 1}) for i in range(2)])
+    db.session.commit()
+    return tees.id, caps.id
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = shop.MemorySearchBackend(max_results=3)
+    monkeypatch.setattr(shop, 'search_backend', backend)
+    return backend
+
+
+def test_category_is_filtered_before_the_cap(db, users, catalog, backend, monkeypatch):
+    customer_id, _ = users
+    _, caps = catalog
+    rendered = {}
+    monkeypatch.setattr(shop, 'render_template', lambda template, **context: rendered.update(context) or template)
+    login(customer_id).get(f'/shop?search=red&category={caps}')
+    assert sorted(product.name for product in rendered['products']) == ['Cap 0', 'Cap 1']
+    assert rendered['pagination'].total == 2
+
+
+def test_results_are_capped(db, catalog, backend):
+    assert len(backend.ranked_ids('red')) == 3
+    assert len(backend.ranked_ids('red', catalog[0])) == 3
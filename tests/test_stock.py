@@ -0,0 +1,56 @@
+from sqlalchemy import event
+
+from conftest import login, shop, stock
+
+
+def test_take_stock_decrements_rows(db, products):
+    assert shop.take_stock({(products[0], 'M'): 3, (products[1], 'L'): 2})
+    db.session.commit()
+    assert (stock(products[0], 'M'), stock(products[1], 'L')) == (2, 0)
+
+
+def test_take_stock_refuses_oversell(db, products):
+    assert not shop.take_stock({(products[0], 'M'): 1, (products[0], 'L'): 3})
+    db.session.rollback()
+    assert (stock(products[0], 'M'), stock(products[0], 'L')) == (5, 2)
+
+
+def test_return_stock_restores_rows(db, products):
+    shop.take_stock({(products[0], 'M'): 4})
+    shop.return_stock(products[0], 'M', 4)
+    shop.return_stock(products[0], 'XL', 1)
+    shop.return_stock_bulk([(products[1], 'M', 2), (products[1], 'S', 3)])
+    db.session.commit()
+    assert (stock(products[0], 'M'), stock(products[0], 'XL')) == (5, 1)
+    assert (stock(products[1], 'M'), stock(products[1], 'S')) == (7, 3)
+
+
+def test_return_stock_bulk_updates_in_lock_order(db, products):
+    updated = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE product_size'):
+            updated.extend(parameters if executemany else [parameters])
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        shop.return_stock_bulk([(products[2], 'M', 1), (products[0], 'M', 1), (products[1], 'L', 1),
+                                (products[1], 'M', 1), (products[0], 'M', 2)])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    db.session.commit()
+    assert [tuple(params) for params in updated] == [(3, products[0], 'M'), (1, products[1], 'L'),
+                                                          (1, products[1], 'M'), (1, products[2], 'M')]
+    assert stock(products[0], 'M') == 8
+
+
+def test_dashboard_totals_come_from_product_size(db, users, products, monkeypatch):
+    _, admin_id = users
+    shop.take_stock({(product_id, 'M'): 5 for product_id in products[:2]})
+    db.session.commit()
+    rendered = {}
+    monkeypatch.setattr(shop, 'render_template', lambda template, **context: rendered.update(context) or template)
+    assert login(admin_id, 'Admin').get('/dashboard').status_code == 200
+    # Every product is under LOW_STOCK_THRESHOLD; value is price * remaining stock
+    assert rendered['low_stock'] == 5
+    assert float(rendered['total_value']) == 10 * 2 + 11 * 2 + (12 + 13 + 14) * 7
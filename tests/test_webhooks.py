@@ -0,0 +1,92 @@
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login, place_order, shop, stock
+
+SECRET = 'whsk_test'
+
+
+def signed_post(client, event_id, event_type='checkout_session.payment.paid', reference='cs_1', secret=SECRET):
+    payload = json.dumps({'data': {'id': event_id, 'attributes': {
+        'type': event_type, 'data': {'id': reference, 'attributes': {}}}}}).encode()
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.'.encode() + payload, hashlib.sha256).hexdigest()
+    return client.post('/webhooks/payments', data=payload, content_type='application/json',
+                       headers={'Paymongo-Signature': f't={timestamp},te={signature},li='})
+
+
+@pytest.fixture
+def webhook(db, monkeypatch):
+    monkeypatch.setenv('PAYMONGO_WEBHOOK_SECRET', SECRET)
+    return shop.app.test_client()
+
+
+@pytest.fixture
+def order(db, users, products):
+    customer_id, _ = users
+    place_order(login(customer_id), customer_id, {(products[0], 'M'): 2})
+    order = shop.Order.query.one()
+    order.payment_method, order.payment_status, order.payment_reference = 'gcash', 'Awaiting', 'cs_1'
+    db.session.commit()
+    return order
+
+
+def test_bad_signature_is_rejected(webhook):
+    assert signed_post(webhook, 'evt_1', secret='wrong').status_code == 401
+    assert shop.PaymentEvent.query.count() == 0
+
+
+def test_stale_signature_is_rejected():
+    payload = b'{}'
+    timestamp = int(time.time()) - shop.PAYMENT_WEBHOOK_TOLERANCE_SECONDS - 5
+    signature = hmac.new(SECRET.encode(), f'{timestamp}.'.encode() + payload, hashlib.sha256).hexdigest()
+    assert not shop.verify_webhook_signature(payload, f't={timestamp},te={signature}', SECRET)
+
+
+def test_redelivered_event_is_queued_once(webhook):
+    assert signed_post(webhook, 'evt_1').status_code == 200
+    assert signed_post(webhook, 'evt_1').status_code == 200
+    assert shop.PaymentEvent.query.count() == 1
+
+
+def test_paid_event_marks_the_order_paid(db, webhook, order):
+    signed_post(webhook, 'evt_1')
+    assert shop.process_payment_events() == 1
+    db.session.refresh(order)
+    assert (order.payment_status, order.status, order.reserved_until) == ('Paid', 'Processing', None)
+
+
+def expire(order):
+    order.reserved_until = datetime.utcnow() - timedelta(minutes=1)
+    shop.db.session.commit()
+    assert shop.release_expired_reservations() == 1
+
+
+def test_payment_after_expiry_takes_the_stock_again(db, webhook, products, order):
+    expire(order)
+    signed_post(webhook, 'evt_1')
+    shop.process_payment_events()
+    db.session.refresh(order)
+    assert (order.payment_status, order.status) == ('Paid', 'Processing')
+    assert stock(products[0], 'M') == 3
+
+
+def test_payment_after_expiry_without_stock_is_flagged(db, webhook, products, order):
+    expire(order)
+    assert shop.take_stock({(products[0], 'M'): 4})
+    db.session.commit()
+    signed_post(webhook, 'evt_1')
+    shop.process_payment_events()
+    db.session.refresh(order)
+    assert (order.payment_status, order.status) == ('Refund Due', 'Expired')
+    assert stock(products[0], 'M') == 1
+    # A later failure notice does not hide the money we hold
+    signed_post(webhook, 'evt_2', event_type='payment.failed')
+    shop.process_payment_events()
+    db.session.refresh(order)
+    assert order.payment_status == 'Refund Due'